@@ -0,0 +1,154 @@
+import logging
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+import inputTxt
+
+logger = logging.getLogger(__name__)
+
+# Errores transitorios que merecen reintento
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+MAP_PROMPT_TEMPLATE = """A continuación se presenta una parte de un conjunto de textos extraídos de noticias, cada uno con su fecha de extracción:
+
+{texto}
+
+Tarea: Resume esta parte como una lista cronológica de hechos. Para cada hecho indica la fecha (o la fecha de extracción si el texto no trae otra), los actores involucrados y lo ocurrido en una o dos frases. Conserva cifras, nombres propios y citas relevantes. No añadas análisis ni información que no esté en los textos.
+"""
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token for Spanish/English text)"""
+    return (len(text) + 3) // 4
+
+
+def split_text(text, budget):
+    """Split ``text`` into pieces of at most ``budget`` estimated tokens.
+
+    Cuts on line breaks first, then between words, and only cuts inside
+    a word (a run of characters with no spaces) as a last resort.
+    """
+    if estimate_tokens(text) <= budget:
+        return [text]
+    for units in (text.splitlines(keepends=True), re.findall(r'\S+\s*|\s+', text)):
+        if len(units) > 1:
+            break
+    else:
+        width = max(1, budget) * 4
+        return [text[i:i + width] for i in range(0, len(text), width)]
+
+    pieces, piece = [], ''
+    for unit in units:
+        if piece and estimate_tokens(piece + unit) > budget:
+            pieces.append(piece)
+            piece = ''
+        piece += unit
+    if piece:
+        pieces.append(piece)
+    # A piece over budget is a single line or word: split it at the next level
+    return [part for piece in pieces for part in split_text(piece, budget)]
+
+
+def split_entries(entries, budget):
+    """Group entries into chunks of at most ``budget`` estimated tokens.
+
+    Entries keep their order; an entry larger than the budget is split
+    with split_text so no chunk exceeds it.
+    """
+    chunks, current, used = [], [], 0
+    for entry in entries:
+        for piece in split_text(entry, budget):
+            size = estimate_tokens(piece)
+            if current and used + size > budget:
+                chunks.append(current)
+                current, used = [], 0
+            current.append(piece)
+            used += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def completar_con_reintentos(prompt, model=None, max_retries=3, backoff=1.0):
+    """inputTxt.completar with exponential backoff and jitter on transient errors"""
+    for attempt in range(max_retries + 1):
+        try:
+            return inputTxt.completar(prompt, model=model)
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff * (2 ** attempt) * (1 + random.random())
+            logger.warning(f'Model call failed ({type(e).__name__}), retrying in {delay:.1f}s')
+            time.sleep(delay)
+
+
+class ChunkedAnalyzer:
+    """Map-reduce condensation of a corpus that does not fit in one prompt.
+
+    ``condensar`` returns the entries unchanged when they fit in
+    ``chunk_tokens``. Otherwise each chunk is summarized concurrently
+    (at most ``max_parallel`` calls in flight) and the summaries are
+    condensed again until they fit. Should a pass stop shrinking them,
+    the text is cut at the budget with a warning, so the caller's final
+    prompt always stays within it.
+    """
+
+    def __init__(self, chunk_tokens=6000, max_parallel=4, max_retries=3, backoff=1.0):
+        self.chunk_tokens = chunk_tokens
+        self.max_parallel = max_parallel
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def fits(self, entries):
+        return estimate_tokens(''.join(entries)) <= self.chunk_tokens
+
+    def _resumir(self, chunk, model):
+        prompt = MAP_PROMPT_TEMPLATE.format(texto=''.join(chunk))
+        return completar_con_reintentos(prompt, model=model, max_retries=self.max_retries, backoff=self.backoff)
+
+    def condensar(self, entries, model=None):
+        """Return ``(texto, chunks)``: text that fits the budget and the number of map calls made"""
+        calls = 0
+        while not self.fits(entries):
+            size = estimate_tokens(''.join(entries))
+            chunks = split_entries(entries, self.chunk_tokens)
+            logger.info(f'Summarizing {len(chunks)} chunks with up to {self.max_parallel} in parallel')
+            with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+                resumenes = list(executor.map(lambda chunk: self._resumir(chunk, model), chunks))
+            calls += len(chunks)
+            entries = [f'\n\n--- Parte {i} ---\n{resumen.strip()}\n' for i, resumen in enumerate(resumenes, 1)]
+            # Stop if a pass made no progress (summaries as long as their input)
+            if len(chunks) == 1 or estimate_tokens(''.join(entries)) >= size:
+                break
+        texto = ''.join(entries)
+        if estimate_tokens(texto) > self.chunk_tokens:
+            logger.warning(f'Summaries still use {estimate_tokens(texto)} tokens, '
+                           f'truncating to the {self.chunk_tokens}-token budget')
+            texto = split_text(texto, self.chunk_tokens)[0]
+        return texto, calls
+
+    def analizar(self, entries, model=None):
+        """Map the chunks, then reduce with the regular timeline prompt"""
+        texto, _ = self.condensar(entries, model=model)
+        return completar_con_reintentos(
+            inputTxt.build_prompt(texto), model=model, max_retries=self.max_retries, backoff=self.backoff)
+
+
+def analyzer_from_env():
+    """Build a ChunkedAnalyzer configured through ANALYSIS_* variables"""
+    return ChunkedAnalyzer(
+        chunk_tokens=int(os.getenv('ANALYSIS_CHUNK_TOKENS', '6000')),
+        max_parallel=int(os.getenv('ANALYSIS_MAX_PARALLEL', '4')),
+        max_retries=int(os.getenv('ANALYSIS_MAX_RETRIES', '3')),
+        backoff=float(os.getenv('ANALYSIS_BACKOFF', '1.0')),
+    )
@@ -1,56 +1,20 @@
 import os
 import sys
+import threading
 from pathlib import Path
 from dotenv import load_dotenv
 from openai import OpenAI
 
-def main():
-    print(" Iniciando el script...")
-    
-    # Cargar variables de entorno desde el directorio raíz del proyecto
-    env_path = Path(__file__).resolve().parent.parent / '.env'
-    if not env_path.exists():
-        print(f"Error: No se encontró el archivo .env en {env_path}")
-        print("Por favor, asegúrate de que el archivo .env existe en el directorio raíz del proyecto.")
-        sys.exit(1)
-    
-    load_dotenv(env_path)
-    
-    # Verificar que la API key esté configurada
-    api_key = os.getenv("OPENROUTER_API_KEY")
-    if not api_key:
-        print("Error: OPENROUTER_API_KEY no está configurada en el archivo .env")
-        sys.exit(1)
-    
-    # Configuración de la API
-    client = OpenAI(
-        base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
-        api_key=api_key,
-    )
+# Modelo y cabeceras opcionales para OpenRouter
+DEFAULT_MODEL = "deepseek/deepseek-r1-0528-qwen3-8b:free"
+EXTRA_HEADERS = {
+    "HTTP-Referer": "https://tusitio.com",
+    "X-Title": "MiScriptDePrueba",
+}
 
-    # Configuración opcional para OpenRouter
-    extra_headers = {
-        "HTTP-Referer": "https://tusitio.com",
-        "X-Title": "MiScriptDePrueba",
-    }
-
-    # Leer el archivo de texto
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    ruta_txt = os.path.join(script_dir, "extracted_texts.txt")
-    
-    print(f" Buscando archivo en: {ruta_txt}")
-    
-    try:
-        with open(ruta_txt, "r", encoding="utf-8") as f:
-            texto = f.read()
-        print(f" Archivo leído correctamente. Tamaño: {len(texto)} caracteres")
-    except Exception as e:
-        print(f" Error al leer el archivo: {e}")
-        print("Asegúrate de que el archivo 'extracted_texts.txt' está en la misma carpeta que el script.")
-        return
+ENV_PATH = Path(__file__).resolve().parent.parent / '.env'
 
-    # Crear el prompt
-    prompt = f"""A continuación se presenta un texto:
+PROMPT_TEMPLATE = """A continuación se presenta un texto:
 
 {texto}
 
@@ -81,20 +45,148 @@ Párrafo de Conclusión sobre el Impacto y Legado.
 [Resumen de los hechos principales, evolución del tema y observaciones sobre el tratamiento periodístico si es relevante.]
 """
 
+UPDATE_PROMPT_TEMPLATE = """A continuación se presenta un análisis previo:
+
+{analisis_previo}
+
+Desde entonces se han extraído estos textos nuevos:
+
+{nuevos_textos}
+
+Tarea: Actualiza el análisis previo incorporando los textos nuevos. Conserva exactamente el mismo formato de salida (título, contexto inicial, línea de tiempo HITO -> ANÁLISIS DEL CONTEXTO, puntos de inflexión y conclusión). Añade los nuevos hitos en su lugar cronológico, revisa los puntos de inflexión y la conclusión si los nuevos textos los cambian, y no elimines información previa que siga siendo válida. Devuelve el análisis completo actualizado.
+"""
+
+_client = None
+_client_lock = threading.Lock()
+
+
+class AnalysisConfigError(Exception):
+    """Raised when the API key or .env configuration is missing"""
+
+
+def get_model():
+    return os.getenv("OPENROUTER_MODEL", DEFAULT_MODEL)
+
+
+def get_client():
+    """Return the shared OpenAI client, creating it on first use.
+
+    The client is kept for the life of the process so its HTTP
+    connection pool is reused across analyses.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            # Cargar variables de entorno desde el directorio raíz del proyecto
+            if ENV_PATH.exists():
+                load_dotenv(ENV_PATH)
+
+            # Verificar que la API key esté configurada
+            api_key = os.getenv("OPENROUTER_API_KEY")
+            if not api_key:
+                raise AnalysisConfigError(
+                    f"OPENROUTER_API_KEY no está configurada (archivo .env esperado en {ENV_PATH})")
+
+            # Configuración de la API
+            _client = OpenAI(
+                base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+                api_key=api_key,
+                timeout=float(os.getenv("OPENROUTER_TIMEOUT", "300")),
+            )
+        return _client
+
+
+def build_prompt(texto):
+    """Crear el prompt de análisis para el texto dado"""
+    return PROMPT_TEMPLATE.format(texto=texto)
+
+
+def build_update_prompt(analisis_previo, nuevos_textos):
+    """Prompt that updates a previous analysis with only the new entries"""
+    return UPDATE_PROMPT_TEMPLATE.format(analisis_previo=analisis_previo, nuevos_textos=nuevos_textos)
+
+
+def completar(prompt, model=None):
+    """Send ``prompt`` to the model and return its answer"""
+    completion = get_client().chat.completions.create(
+        model=model or get_model(),
+        messages=[{"role": "user", "content": prompt}],
+        extra_headers=EXTRA_HEADERS,
+    )
+    return completion.choices[0].message.content
+
+
+def completar_stream(prompt, model=None):
+    """Like completar, but yield the answer token by token as it arrives"""
+    stream = get_client().chat.completions.create(
+        model=model or get_model(),
+        messages=[{"role": "user", "content": prompt}],
+        extra_headers=EXTRA_HEADERS,
+        stream=True,
+    )
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
+
+
+def analizar(texto, model=None):
+    """Send the analysis prompt for ``texto`` and return the model's answer"""
+    return completar(build_prompt(texto), model=model)
+
+
+def analizar_stream(texto, model=None):
+    """Like analizar, but yield the answer token by token as it arrives"""
+    return completar_stream(build_prompt(texto), model=model)
+
+
+def main():
+    print(" Iniciando el script...")
+    
+    if not ENV_PATH.exists():
+        print(f"Error: No se encontró el archivo .env en {ENV_PATH}")
+        print("Por favor, asegúrate de que el archivo .env existe en el directorio raíz del proyecto.")
+        sys.exit(1)
+
+    try:
+        get_client()
+    except AnalysisConfigError:
+        print("Error: OPENROUTER_API_KEY no está configurada en el archivo .env")
+        sys.exit(1)
+
+    # Leer el archivo de texto
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    ruta_txt = os.path.join(script_dir, "extracted_texts.txt")
+    
+    print(f" Buscando archivo en: {ruta_txt}")
+    
+    try:
+        with open(ruta_txt, "r", encoding="utf-8") as f:
+            texto = f.read()
+        print(f" Archivo leído correctamente. Tamaño: {len(texto)} caracteres")
+
+        # Quitar cabeceras, separadores y duplicados antes de enviar
+        import prompt_prep
+        preparado = prompt_prep.prepare(prompt_prep.parse_entries(texto), **prompt_prep.settings_from_env())
+        texto = ''.join(preparado['entries'])
+        print(f" Tokens estimados: {preparado['tokens_before']} -> {preparado['tokens_after']}")
+    except Exception as e:
+        print(f" Error al leer el archivo: {e}")
+        print("Asegúrate de que el archivo 'extracted_texts.txt' está en la misma carpeta que el script.")
+        return
+
     print("\n Enviando solicitud al modelo...")
     
     try:
         # Llamar al modelo
-        completion = client.chat.completions.create(
-            model="deepseek/deepseek-r1-0528-qwen3-8b:free",
-            messages=[{"role": "user", "content": prompt}],
-            extra_headers=extra_headers,
-        )
+        respuesta = analizar(texto)
         
         # Mostrar la respuesta
         print("\n Respuesta del modelo:")
         print("-" * 50)
-        print(completion.choices[0].message.content)
+        print(respuesta)
         print("-" * 50)
         
     except Exception as e:
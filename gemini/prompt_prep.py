@@ -0,0 +1,109 @@
+import os
+import re
+import unicodedata
+from collections import Counter
+
+from chunked import estimate_tokens
+
+# One block of the extracted_texts.txt format written by save_extracted_text
+_ENTRY_RE = re.compile(
+    r'^--- (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) ---\n(.*?)\n={50}$',
+    re.MULTILINE | re.DOTALL)
+# Cabeceras de medios que aparecen en las capturas y no aportan al análisis
+DEFAULT_MASTHEADS = ('EL TIEMPO', 'EL ESPECTADOR', 'SEMANA', 'EL PAÍS', 'INFOBAE', 'CNN', 'BBC News Mundo')
+# Lines with no letters or digits, e.g. a lone "”" or "—" left by OCR
+_JUNK_LINE_RE = re.compile(r'^[\W_]*$', re.UNICODE)
+
+
+def parse_entries(texto):
+    """Parse extracted_texts.txt content into ``{'created_at', 'text'}`` records"""
+    return [{'created_at': ts, 'text': text} for ts, text in _ENTRY_RE.findall(texto) if text.strip()]
+
+
+def _key(line):
+    line = unicodedata.normalize('NFKD', line)
+    line = ''.join(ch for ch in line if not unicodedata.combining(ch))
+    return ' '.join(re.sub(r'[\W_]+', ' ', line.lower(), flags=re.UNICODE).split())
+
+
+def find_mastheads(records, min_share=0.3, min_entries=2, max_words=4):
+    """Short lines repeated across many entries (e.g. "EL TIEMPO", "Internacional")"""
+    counts = Counter()
+    total = 0
+    for record in records:
+        total += 1
+        counts.update({_key(line) for line in record['text'].splitlines() if line.strip()})
+    threshold = max(min_entries, min_share * total)
+    return {key for key, n in counts.items()
+            if key and n >= threshold and len(key.split()) <= max_words}
+
+
+def compact_text(text, mastheads=()):
+    """Join OCR line breaks into paragraphs and drop masthead and junk lines"""
+    paragraphs, current = [], []
+    for line in text.splitlines():
+        line = ' '.join(line.split())
+        if not line:
+            if current:
+                paragraphs.append(' '.join(current))
+                current = []
+            continue
+        if _JUNK_LINE_RE.match(line) or _key(line) in mastheads:
+            continue
+        current.append(line)
+    if current:
+        paragraphs.append(' '.join(current))
+    return ' / '.join(paragraphs)
+
+
+def prepare(records, context=None, token_budget=0, extra_mastheads=()):
+    """Turn stored records into compact prompt entries.
+
+    Mastheads are detected over ``context`` (defaults to ``records``) so
+    an incremental batch still recognises the corpus-wide ones. Entries
+    that normalize to the same text are sent once. With a
+    ``token_budget`` the oldest entries are dropped until the rest fit.
+    Returns a dict with the ``entries`` and before/after token counts.
+    """
+    records = list(records)
+    mastheads = find_mastheads(context if context is not None else records)
+    mastheads |= {_key(m) for m in DEFAULT_MASTHEADS + tuple(extra_mastheads)}
+
+    tokens_before = 0
+    entries, seen, duplicates = [], set(), 0
+    for record in records:
+        tokens_before += estimate_tokens(
+            f"\n\n--- {record['created_at']} ---\n{record['text']}\n{'=' * 50}\n")
+        text = compact_text(record['text'], mastheads)
+        key = _key(text)
+        if not key:
+            continue
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        entries.append(f"[{record['created_at'][:16]}] {text}\n")
+
+    truncated = 0
+    if token_budget:
+        while len(entries) > 1 and estimate_tokens(''.join(entries)) > token_budget:
+            entries.pop(0)
+            truncated += 1
+
+    return {
+        'entries': entries,
+        'tokens_before': tokens_before,
+        'tokens_after': estimate_tokens(''.join(entries)),
+        'mastheads': sorted(mastheads),
+        'duplicates': duplicates,
+        'truncated': truncated,
+    }
+
+
+def settings_from_env():
+    """Prompt preparation settings from PROMPT_* variables"""
+    extra = os.getenv('PROMPT_MASTHEADS', '')
+    return {
+        'token_budget': int(os.getenv('PROMPT_TOKEN_BUDGET', '0')),
+        'extra_mastheads': [m.strip() for m in extra.split(',') if m.strip()],
+    }
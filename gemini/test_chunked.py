@@ -0,0 +1,168 @@
+"""Tests for the chunked map-reduce analysis, against a local OpenAI-compatible stub.
+
+Run from this directory with ``python -m unittest test_chunked`` (or pytest).
+"""
+import json
+import os
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import openai
+
+import chunked
+import inputTxt
+from chunked import ChunkedAnalyzer, completar_con_reintentos, estimate_tokens, split_entries, split_text
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers /v1/chat/completions: a short summary for map prompts, a fixed timeline otherwise"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        stub = self.server.stub
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        prompt = request['messages'][0]['content']
+        with stub['lock']:
+            stub['prompts'].append(prompt)
+            stub['in_flight'] += 1
+            stub['max_in_flight'] = max(stub['max_in_flight'], stub['in_flight'])
+        time.sleep(0.02)
+        with stub['lock']:
+            stub['in_flight'] -= 1
+            n = len(stub['prompts'])
+        if prompt.startswith(chunked.MAP_PROMPT_TEMPLATE[:40]):
+            content = f'Resumen {n}.'
+        else:
+            content = 'Línea de tiempo final.'
+        body = json.dumps({
+            'id': 'stub', 'object': 'chat.completion', 'created': int(time.time()), 'model': request['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class SplitTests(unittest.TestCase):
+    def assert_within(self, chunks, budget):
+        for chunk in chunks:
+            self.assertLessEqual(estimate_tokens(''.join(chunk)), budget)
+
+    def test_entries_are_grouped_in_order(self):
+        entries = [f'entrada {i}\n' for i in range(30)]
+        chunks = split_entries(entries, 20)
+        self.assertGreater(len(chunks), 1)
+        self.assert_within(chunks, 20)
+        self.assertEqual([piece for chunk in chunks for piece in chunk], entries)
+
+    def test_multiline_entry_is_split_on_line_breaks(self):
+        entry = ''.join(f'línea número {i}\n' for i in range(40))
+        pieces = split_text(entry, 30)
+        self.assertGreater(len(pieces), 1)
+        self.assertTrue(all(piece.endswith('\n') for piece in pieces))
+        self.assertEqual(''.join(pieces), entry)
+
+    def test_single_line_entry_is_split_between_words(self):
+        # Prompt-prep entries are one line each
+        entry = '[2025-06-07 21:35] ' + ' '.join(f'palabra{i}' for i in range(200)) + '\n'
+        chunks = split_entries([entry], 40)
+        self.assert_within(chunks, 40)
+        pieces = [piece for chunk in chunks for piece in chunk]
+        self.assertEqual(''.join(pieces), entry)
+        self.assertTrue(all(piece.endswith((' ', '\n')) for piece in pieces))
+
+    def test_text_without_spaces_is_cut(self):
+        chunks = split_entries(['a' * 400], 40)
+        self.assert_within(chunks, 40)
+        self.assertEqual(''.join(piece for chunk in chunks for piece in chunk), 'a' * 400)
+
+
+class MapReduceTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.env = mock.patch.dict(os.environ, {
+            'OPENROUTER_BASE_URL': f'http://127.0.0.1:{cls.server.server_port}/v1',
+            'OPENROUTER_API_KEY': 'stub',
+        })
+        cls.env.start()
+        # A fresh shared client pointed at the stub
+        cls.client = mock.patch.object(inputTxt, '_client', None)
+        cls.client.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.stop()
+        cls.env.stop()
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.stub = {'prompts': [], 'in_flight': 0, 'max_in_flight': 0, 'lock': threading.Lock()}
+
+    def test_small_corpus_is_not_summarized(self):
+        texto, calls = ChunkedAnalyzer(chunk_tokens=1000).condensar(['[2025-06-07] corto\n'], model='stub')
+        self.assertEqual(calls, 0)
+        self.assertEqual(texto, '[2025-06-07] corto\n')
+        self.assertEqual(self.server.stub['prompts'], [])
+
+    def test_map_then_reduce(self):
+        entries = [f'[2025-06-{i % 28 + 1:02d}] ' + 'noticia ' * 30 + '\n' for i in range(40)]
+        analyzer = ChunkedAnalyzer(chunk_tokens=200, max_parallel=3, backoff=0)
+        expected_chunks = len(split_entries(entries, 200))
+
+        result = analyzer.analizar(entries, model='stub')
+
+        prompts = self.server.stub['prompts']
+        self.assertEqual(result, 'Línea de tiempo final.')
+        # One map call per chunk, then the reduce call
+        self.assertEqual(len(prompts), expected_chunks + 1)
+        map_overhead = estimate_tokens(chunked.MAP_PROMPT_TEMPLATE.format(texto=''))
+        for prompt in prompts[:-1]:
+            self.assertLessEqual(estimate_tokens(prompt) - map_overhead, 200 + 1)
+        self.assertIn('--- Parte 1 ---', prompts[-1])
+        self.assertIn(f'--- Parte {expected_chunks} ---', prompts[-1])
+        self.assertLessEqual(self.server.stub['max_in_flight'], 3)
+
+    def test_oversize_single_entry_is_summarized_in_pieces(self):
+        entries = ['[2025-06-07] ' + 'palabra ' * 1000 + '\n']
+        texto, calls = ChunkedAnalyzer(chunk_tokens=300, backoff=0).condensar(entries, model='stub')
+        self.assertGreater(calls, 1)
+        self.assertLessEqual(estimate_tokens(texto), 300)
+
+    def test_summaries_that_do_not_shrink_are_truncated(self):
+        entries = [f'[2025-06-{i + 1:02d}] ' + 'noticia ' * 100 + '\n' for i in range(10)]
+        with mock.patch.object(inputTxt, 'completar', return_value='resumen ' * 1000):
+            with self.assertLogs('chunked', 'WARNING'):
+                texto, calls = ChunkedAnalyzer(chunk_tokens=300, backoff=0).condensar(entries, model='stub')
+        self.assertGreater(calls, 0)
+        self.assertLessEqual(estimate_tokens(texto), 300)
+        self.assertTrue(texto.startswith('\n\n--- Parte 1 ---'))
+
+
+class RetryTests(unittest.TestCase):
+    def test_transient_errors_are_retried(self):
+        error = openai.APIConnectionError(request=mock.Mock())
+        with mock.patch.object(inputTxt, 'completar', side_effect=[error, error, 'ok']) as completar:
+            self.assertEqual(completar_con_reintentos('prompt', max_retries=3, backoff=0), 'ok')
+        self.assertEqual(completar.call_count, 3)
+
+    def test_gives_up_after_max_retries(self):
+        error = openai.APIConnectionError(request=mock.Mock())
+        with mock.patch.object(inputTxt, 'completar', side_effect=error) as completar:
+            with self.assertRaises(openai.APIConnectionError):
+                completar_con_reintentos('prompt', max_retries=2, backoff=0)
+        self.assertEqual(completar.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
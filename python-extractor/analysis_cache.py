@@ -0,0 +1,77 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outputs (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    output TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state (
+    model TEXT PRIMARY KEY,
+    last_entry_id INTEGER NOT NULL,
+    output TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+);
+'''
+
+
+def prompt_key(model, prompt):
+    """Cache key for a model output: hash of the model name and the full prompt"""
+    return hashlib.sha256(f'{model}\0{prompt}'.encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """Remembers model outputs and how far into the corpus each model got.
+
+    ``outputs`` maps a prompt key to the model's answer, so an identical
+    prompt is never sent twice. ``state`` records, per model, the id of
+    the last stored entry already covered by its latest analysis.
+    """
+
+    def __init__(self, db_path):
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get_output(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT output FROM outputs WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def get_state(self, model):
+        """Return ``(last_entry_id, output)`` for ``model``, or None"""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT last_entry_id, output FROM state WHERE model = ?', (model,)).fetchone()
+
+    def save_output(self, key, model, output):
+        """Remember an output without moving the model's corpus state (partial analyses)"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO outputs (key, model, output, created_at) VALUES (?, ?, ?, ?)',
+                (key, model, output, now))
+            self._conn.commit()
+
+    def save(self, key, model, output, last_entry_id):
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO outputs (key, model, output, created_at) VALUES (?, ?, ?, ?)',
+                (key, model, output, now))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO state (model, last_entry_id, output, updated_at) VALUES (?, ?, ?, ?)',
+                (model, last_entry_id, output, now))
+            self._conn.commit()
+
+
+def analysis_cache_from_env(default_dir):
+    """Open the AnalysisCache at ANALYSIS_CACHE_PATH (default: analysis.sqlite3 in ``default_dir``)"""
+    return AnalysisCache(os.getenv('ANALYSIS_CACHE_PATH') or os.path.join(default_dir, 'analysis.sqlite3'))
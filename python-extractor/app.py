@@ -1,21 +1,51 @@
-from flask import Flask, request, jsonify, send_from_directory, send_file, make_response
+from flask import Flask, request, jsonify, send_from_directory, send_file, make_response, Response, stream_with_context, g
 from flask_cors import CORS, cross_origin
 from PIL import Image
 import requests
 from io import BytesIO, StringIO
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 import time
 import os
 import logging
 import sys
 import pytesseract
 from werkzeug.serving import WSGIRequestHandler
-import tempfile
-from datetime import datetime
-import subprocess
 import json
+import re
 from pathlib import Path
+import atexit
+import random
+import hmac
+from browser_pool import pool_from_env
+from image_resolver import ImageNotFound, resolver_from_env
+from resolution_cache import cache_from_env
+from ocr_cache import image_digest, ocr_cache_from_env
+from ocr_engine import engine_from_env
+import preprocess
+from ocr_tiers import tiered_from_env
+from image_store import image_store_from_env
+from downloader import downloader_from_env
+import metrics
+from metrics import timed
+from profiling import RequestProfile, profiling_from_env
+from jobs import JobCancelled, JobQueueFull, jobs_from_env
+from batch import HostLimiter, batch_settings_from_env, run_batch
+from text_store import text_store_from_env
+from topic_clusters import clusters_from_env
+from export import ExportError, export_response
+
+# The analysis module lives in ../gemini and is imported in-process
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gemini'))
+import inputTxt as analisis
+from chunked import analyzer_from_env, completar_con_reintentos
+import prompt_prep
+from analysis_cache import analysis_cache_from_env, prompt_key
+
+if __name__ == '__main__':
+    # Serve from server.py as __main__: spawned OCR workers re-import the main
+    # script, and must not re-run the wiring below
+    import runpy
+    runpy.run_module('server', run_name='__main__', alter_sys=True)
+    sys.exit()
 
 # Configure CORS
 cors = CORS()
@@ -31,8 +61,9 @@ app = create_app()
 CORS(app, resources={
     r"/*": {
         "origins": "*",
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type"]
+        "methods": ["GET", "POST", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type"],
+        "expose_headers": ["X-Export-Cursor"]
     }
 })
 
@@ -58,131 +89,446 @@ logger = logging.getLogger(__name__)
 temp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temp')
 os.makedirs(temp_dir, exist_ok=True)
 
-# Path for the text file to store all extracted text
+# Pool of warm headless Chrome drivers shared by all requests
+browser_pool = pool_from_env()
+atexit.register(browser_pool.close)
+
+# Downloaded images stored as-is under their content hash
+image_store = image_store_from_env(temp_dir)
+atexit.register(image_store.close)
+# Served names never change content, so browsers may keep them for a year
+IMAGE_MAX_AGE = int(os.getenv('IMAGE_STORE_MAX_AGE', str(365 * 24 * 3600)))
+# tempfile names of the images saved straight into temp/ before the store;
+# nothing else in temp/ (the SQLite databases, caches) is ever served
+LEGACY_IMAGE_RE = re.compile(r'^tmp[a-z0-9_]+\.jpg$')
+
+# Pooled, size-capped HTTP client for every image download
+downloader = downloader_from_env(store=image_store)
+image_resolver = resolver_from_env(browser_pool, cache=cache_from_env(temp_dir), session=downloader.session)
+
+# OCR results keyed by image content so duplicate images skip Tesseract
+ocr_cache = ocr_cache_from_env(temp_dir)
+
+# Long-lived Tesseract workers, one per core
+ocr_engine = engine_from_env()
+atexit.register(ocr_engine.shutdown)
+# Downscale, binarize and crop to text regions before OCR
+preprocess_settings = preprocess.settings_from_env()
+# Fast models first, best models only for low-confidence results
+tiered_ocr = tiered_from_env(ocr_engine)
+
+# Background workers for the asynchronous /jobs API
+job_manager = jobs_from_env()
+atexit.register(job_manager.shutdown)
+
+# Limits for /extract-batch
+batch_settings = batch_settings_from_env()
+
+class ExtractionError(Exception):
+    """Raised by the pipelines when the post image cannot be obtained"""
+
+# Path of the legacy append-only text file, imported once into the text store
 text_file_path = os.path.join(temp_dir, 'extracted_texts.txt')
 
-# Ensure the text file exists
+# Extracted texts live in SQLite with a full-text index
+text_store = text_store_from_env(temp_dir)
 try:
-    if not os.path.exists(text_file_path):
-        with open(text_file_path, 'w', encoding='utf-8') as f:
-            f.write('Archivo de textos extraídos\n' + '=' * 30 + '\n\n')
+    text_store.import_legacy_file(text_file_path)
 except Exception as e:
-    logger.error(f'Error creating text file: {str(e)}')
+    logger.error(f'Error importing legacy text file: {str(e)}')
+
+# Local topic clusters over the stored texts, updated on every save
+topic_clusters = clusters_from_env()
+if topic_clusters is not None:
+    topic_clusters.load(text_store.iter_entries())
+
+# Model outputs and per-model progress through the corpus
+analysis_cache = analysis_cache_from_env(temp_dir)
+# Map-reduce condensation for corpora larger than one prompt
+chunked_analyzer = analyzer_from_env()
+prompt_settings = prompt_prep.settings_from_env()
+
+def save_extracted_text(text: str, source_url=None, image_hash=None, ocr=None):
+    """Store extracted text with a timestamp, its source URL, image hash and OCR tier/confidence.
 
-def save_extracted_text(text: str):
-    """Append extracted text to the text file with a timestamp"""
+    Near-duplicates of a stored text are linked to it instead of stored
+    again; returns ``(row_id, duplicate)``.
+    """
     try:
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        with open(text_file_path, 'a', encoding='utf-8') as f:
-            f.write(f'\n\n--- {timestamp} ---\n')
-            f.write(text.strip())
-            f.write('\n' + '='*50 + '\n')  # Add separator between entries
+        ocr = ocr or {}
+        with timed('save'):
+            row_id, duplicate = text_store.add(text, source_url=source_url, image_hash=image_hash,
+                                               ocr_tier=ocr.get('tier'), ocr_confidence=ocr.get('confidence'))
     except Exception as e:
         logger.error(f'Error saving extracted text: {str(e)}')
         raise
+    if topic_clusters is not None and not duplicate:
+        try:
+            topic_clusters.add(row_id, text)
+        except Exception as e:
+            # The text is stored; clusters catch up on the next rebuild
+            logger.error(f'Error clustering extracted text: {str(e)}')
+    return row_id, duplicate
+
+def extraer_texto(img, data):
+    """OCR an image, reusing the cached result when these bytes were seen before.
+
+    Returns ``{'text', 'tier', 'confidence'}``.
+    """
+    # Crop size and DPI change what Tesseract sees, so they are part of the key too
+    params = dict(tiered_ocr.params(), preprocess=preprocess_settings)
+    cached = ocr_cache.get_entry(data, img, params)
+    if cached is not None:
+        logger.info('OCR cache hit, skipping Tesseract')
+        return dict(cached['meta'], text=cached['text'])
+
+    if preprocess_settings['enabled']:
+        with timed('preprocess'):
+            crops = preprocess.text_crops(
+                img, max_side=preprocess_settings['max_side'], target_dpi=preprocess_settings['target_dpi'])
+        # Each crop is a block of text lines; the whole-image fallback keeps auto layout
+        psm = 6 if len(crops) > 1 else None
+    else:
+        crops, psm = [img], None
+    with timed('ocr'):
+        result = tiered_ocr.recognize(crops, psm=psm)
+    ocr_cache.put(data, img, params, result['text'],
+                  meta={'tier': result['tier'], 'confidence': result['confidence']})
+    return result
 
 # CORS is already configured above
 
-# Log all requests
+# Request logging: one structured line per sampled request. Errors and slow
+# requests are always logged; bodies only when LOG_BODIES=1, truncated.
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '0.1'))
+LOG_SLOW_MS = float(os.getenv('LOG_SLOW_MS', '2000'))
+LOG_BODIES = os.getenv('LOG_BODIES', '0') == '1'
+LOG_BODY_MAX = int(os.getenv('LOG_BODY_MAX', '512'))
+
+def _truncate(data):
+    text = data[:LOG_BODY_MAX].decode('utf-8', errors='replace')
+    return text + f'… (+{len(data) - LOG_BODY_MAX} bytes)' if len(data) > LOG_BODY_MAX else text
+
 @app.before_request
-def log_request_info():
-    if request.path != '/':  # Skip logging for static files unless needed
-        logger.info(f'Request: {request.method} {request.path}')
-        logger.info(f'Headers: {dict(request.headers)}')
-        if request.get_data():
-            logger.info(f'Body: {request.get_data().decode()}')
+def start_timer():
+    g.request_start = time.perf_counter()
 
 @app.after_request
 def after_request(response):
-    # Skip logging for static files
-    if request.path.startswith('/static/'):
+    start = g.pop('request_start', None)
+    if start is None:
         return response
-        
-    # Log response status and data if it's JSON
-    response_data = None
-    try:
-        if response.is_json:
-            response_data = response.get_json()
-    except:
-        pass
-        
-    if response_data:
-        logger.info(f'Response: {response.status} {response_data}')
-    else:
-        logger.info(f'Response: {response.status} [Non-JSON response]')
-        
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUEST_SECONDS.observe(elapsed, route, response.status_code)
+
+    elapsed_ms = elapsed * 1000
+    if response.status_code < 400 and elapsed_ms < LOG_SLOW_MS and random.random() >= LOG_SAMPLE_RATE:
+        return response
+    entry = {
+        'method': request.method,
+        'route': route,
+        'path': request.path,
+        'status': response.status_code,
+        'ms': round(elapsed_ms, 1),
+        'bytes': response.content_length,
+    }
+    if LOG_BODIES:
+        if request.content_length and request.content_length <= 64 * LOG_BODY_MAX:
+            entry['request_body'] = _truncate(request.get_data(cache=True))
+        # Streamed responses (SSE, NDJSON, exports) are never buffered for logging
+        if not response.is_streamed and response.is_json:
+            entry['response_body'] = _truncate(response.get_data())
+    logger.info(json.dumps(entry, ensure_ascii=False))
     return response
 
-def obtener_imagen_instagram(url):
-    # Configurar Selenium
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    chrome_options.add_argument("--window-size=1920,1080")
-    
-    # Configurar el navegador para parecer más real
-    chrome_options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
-    
-    driver = webdriver.Chrome(options=chrome_options)
-    
+# Opt-in profiling of single requests (X-Profile header or ?profile=)
+profiling = profiling_from_env(temp_dir)
+
+def _admin_allowed():
+    token = profiling['token']
+    return not token or hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token)
+
+@app.before_request
+def start_profile():
+    if not profiling['enabled']:
+        return
+    flag = request.headers.get('X-Profile') or request.args.get('profile')
+    if flag and flag != '0' and _admin_allowed():
+        # "cprofile" for deterministic pstats; anything else samples stacks
+        mode = 'cprofile' if flag == 'cprofile' else 'sample'
+        g.profile = RequestProfile(mode, interval=profiling['interval'])
+
+@app.after_request
+def finish_profile(response):
+    profile = g.pop('profile', None)
+    if profile is None:
+        return response
+    # Streamed bodies are produced after this hook and are not covered
+    profile.stop()
+    meta = profiling['store'].save(profile, method=request.method, path=request.path,
+                                   status=response.status_code)
+    response.headers['X-Profile-Id'] = meta['id']
+    logger.info(f"Profiled {request.method} {request.path} in {meta['elapsed_ms']} ms: {meta['id']}")
+    return response
+
+@app.route('/admin/profiles')
+def list_profiles():
+    if not profiling['enabled'] or not _admin_allowed():
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify({'success': True, 'profiles': profiling['store'].list()})
+
+@app.route('/admin/profiles/<profile_id>/<fmt>')
+def get_profile(profile_id, fmt):
+    if not profiling['enabled'] or not _admin_allowed():
+        return jsonify({'error': 'Not found'}), 404
+    path = profiling['store'].path_for(profile_id, fmt)
+    if path is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    mimetype = 'application/json' if fmt == 'speedscope' else (
+        'text/plain' if fmt == 'collapsed' else 'application/octet-stream')
+    return send_file(path, mimetype=mimetype, as_attachment=True,
+                     download_name=os.path.basename(path))
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Per-stage and per-route latency histograms in Prometheus text format"""
+    # Werkzeug appends the charset itself; a second one breaks Prometheus' parser
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def obtener_imagen_instagram(url, progress=None):
+    """Resolve the post image and download it.
+
+    Returns a dict with the PIL ``image`` plus the resolver's ``img_url``,
+    ``tier`` and ``elapsed_ms``, or None on failure.
+    """
+    report = progress or (lambda stage: None)
     try:
-        # Abrir la URL
-        driver.get(url)
-        
-        # Esperar a que la página cargue completamente
-        time.sleep(5)
-        
-        # Intentar diferentes selectores comunes de Instagram
-        selectores = [
-            "//img[contains(@alt, 'Photo by')]",  # Selector por atributo alt
-            "//div[contains(@class, 'x5yr21d')]//img",  # Selector por clase contenedora
-            "//div[contains(@class, '_aagv')]//img",  # Clase común para imágenes
-            "//article//img",  # Último recurso: cualquier imagen dentro de un artículo
-            "//img[contains(@src, 'scontent.cdninstagram.com')]"  # Selector por dominio de la imagen
-        ]
-        
-        img_element = None
-        for selector in selectores:
-            try:
-                elements = driver.find_elements("xpath", selector)
-                for element in elements:
-                    src = element.get_attribute('src')
-                    if src and 'http' in src:
-                        img_element = element
-                        break
-                if img_element:
-                    break
-            except:
-                continue
-        
-        if not img_element:
-            # Tomar captura de pantalla para depuración
-            driver.save_screenshot('debug_screenshot.png')
-            print("Se ha guardado una captura de pantalla para depuración: debug_screenshot.png")
-            raise Exception("No se pudo encontrar ningún elemento de imagen con los selectores conocidos")
-        
-        img_url = img_element.get_attribute('src')
+        # Probar primero el HTML de la publicación y usar el navegador solo si falla
+        report('resolve')
+        resolucion = image_resolver.resolve(url)
+        img_url = resolucion['img_url']
         if not img_url:
             raise Exception("La URL de la imagen está vacía")
-            
+
         # Descargar imagen
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(img_url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        img = Image.open(BytesIO(response.content))
+        report('download')
+        try:
+            content = downloader.fetch(img_url)
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if resolucion['tier'] != 'cache' or status not in (403, 404):
+                raise
+            # La URL del CDN en caché caducó: invalidar y volver a resolver
+            logger.info(f'Cached image URL returned {status}, re-resolving {url}')
+            image_resolver.invalidate(url)
+            resolucion = image_resolver.resolve(url, use_cache=False)
+            img_url = resolucion['img_url']
+            content = downloader.fetch(img_url)
+
+        img = decodificar(content)
         logger.info(f'Imagen descargada - Dimensiones originales: {img.width}x{img.height}')
-        return img
+        return dict(resolucion, image=img, content=content, source_url=url)
 
+    except JobCancelled:
+        raise
     except Exception as e:
         print(f"Error al obtener la imagen: {str(e)}")
         return None
-    finally:
-        driver.quit()
+
+def procesar_post(url, host, progress=None):
+    """Scrape -> download -> OCR pipeline behind /extract-image.
+
+    Returns the JSON payload for the client; raises ExtractionError when
+    the post image cannot be obtained.
+    """
+    report = progress or (lambda stage: None)
+    resultado = obtener_imagen_instagram(url, progress=report)
+    if not resultado:
+        raise ExtractionError('No se pudo extraer la imagen')
+    return finalizar_post(resultado, host, report)
+
+def finalizar_post(resultado, host, report):
+    """Store and OCR an image fetched by obtener_imagen_instagram"""
+    img = resultado['image']
+    # Keep the downloaded bytes untouched; PIL only decodes them for OCR
+    report('store')
+    filename = image_store.put(resultado['content'], img.format)
+
+    image_url = f'http://{host}/download/{filename}'
+    logger.info(f'Imagen original guardada ({len(resultado["content"])} bytes): {img.width}x{img.height}')
+
+    # Extract text using pytesseract
+    report('ocr')
+    try:
+        # Extract text in Spanish and English
+        ocr = extraer_texto(img, resultado['content'])
+        text = ocr['text']
+
+        if text and text.strip():
+            logger.info(f'Successfully extracted text ({ocr["tier"]}, conf {ocr["confidence"]}): {text[:100]}...')
+            save_extracted_text(text, source_url=resultado['source_url'],
+                                image_hash=image_digest(resultado['content']), ocr=ocr)
+        else:
+            logger.info('No text was extracted from the image')
+    except Exception as e:
+        logger.error(f'Error extracting text: {str(e)}', exc_info=True)
+        # Continue even if text extraction fails - we still want to return the image
+
+    return {
+        'success': True,
+        'image_url': image_url,
+        'resolver': {
+            'tier': resultado['tier'],
+            'elapsed_ms': resultado['elapsed_ms']
+        }
+    }
+
+def procesar_carrusel(url, host, progress=None):
+    """Carousel pipeline: every image of a post from a single page visit.
+
+    The images are downloaded concurrently (per-host limit as in batches)
+    and OCR'd in parallel on the OCR engine pool; each text is saved
+    against the post URL. Returns the per-image results in slide order and
+    their texts joined as ``text``.
+    """
+    report = progress or (lambda stage: None)
+    report('resolve')
+    try:
+        resolucion = image_resolver.resolve_all(url)
+    except (ImageNotFound, requests.exceptions.RequestException) as e:
+        raise ExtractionError(f'No se pudieron extraer las imágenes: {str(e)}')
+    if not resolucion['img_urls']:
+        raise ExtractionError('No se pudieron extraer las imágenes')
+
+    def fetch(img_url):
+        return descargar_imagen(img_url, lambda stage: None) + (img_url,)
+
+    def process(fetched):
+        img, content, img_url = fetched
+        filename = image_store.put(content, img.format)
+        ocr = extraer_texto(img, content)
+        text = ocr['text'].strip()
+        if text:
+            save_extracted_text(text, source_url=url, image_hash=image_digest(content), ocr=ocr)
+        return {
+            'success': True,
+            'image_url': f'http://{host}/download/{filename}',
+            'text': text,
+            'ocr': {'tier': ocr['tier'], 'confidence': ocr['confidence']}
+        }
+
+    report('ocr')
+    imagenes = sorted(run_batch(
+        resolucion['img_urls'], fetch, process,
+        max_workers=batch_settings['carousel_workers'],
+        limiter=HostLimiter(batch_settings['per_host'])
+    ), key=lambda imagen: imagen['index'])
+    if not any(imagen['success'] for imagen in imagenes):
+        raise ExtractionError('No se pudo descargar ninguna imagen del carrusel')
+
+    return {
+        'success': True,
+        'text': '\n\n'.join(imagen['text'] for imagen in imagenes if imagen.get('text')),
+        'images': imagenes,
+        'resolver': {
+            'tier': resolucion['tier'],
+            'elapsed_ms': resolucion['elapsed_ms'],
+            'images': len(resolucion['img_urls'])
+        }
+    }
+
+def procesar_imagen_url(image_url, progress=None):
+    """Download -> OCR -> save pipeline behind /extract-text"""
+    report = progress or (lambda stage: None)
+    logger.info(f'Processing image URL: {image_url}')
+    img, content = descargar_imagen(image_url, report)
+    return texto_de_imagen(img, content, report, source_url=image_url)
+
+def descargar_imagen(image_url, report):
+    """Download an image URL and return the decoded image with its raw bytes"""
+    # Download the image
+    report('download')
+    content = downloader.fetch(image_url)
+
+    # Open the image
+    return decodificar(content), content
+
+def decodificar(content):
+    """Decode downloaded bytes into a PIL image, eagerly so the decode stage is timed"""
+    with timed('decode'):
+        img = Image.open(BytesIO(content))
+        img.load()
+    return img
+
+def texto_de_imagen(img, content, report, source_url=None):
+    """OCR a downloaded image and save the text"""
+    # Extract text using pytesseract
+    report('ocr')
+    ocr = extraer_texto(img, content)
+
+    # Clean up the extracted text
+    text = ocr['text'].strip()
+
+    if not text:
+        return {
+            'success': False,
+            'error': 'No se pudo extraer texto de la imagen'
+        }
+
+    logger.info(f'Successfully extracted text ({ocr["tier"]}, conf {ocr["confidence"]}): {text[:100]}...')
+
+    # Save the extracted text
+    report('save')
+    save_extracted_text(text, source_url=source_url, image_hash=image_digest(content), ocr=ocr)
+
+    return {
+        'success': True,
+        'text': text,
+        'ocr': {
+            'tier': ocr['tier'],
+            'confidence': ocr['confidence']
+        }
+    }
+
+def extraer_lote(urls, tipo='image', host='localhost:5000'):
+    """Extract a list of post URLs (``tipo='post'``), carousel post URLs
+    (``tipo='carousel'``) or image URLs (``tipo='image'``).
+
+    Downloads run concurrently with a per-host limit and OCR runs in
+    parallel on the OCR engine pool. Yields one result dict per URL, in
+    completion order.
+    """
+    noop = lambda stage: None
+    if tipo == 'post':
+        def fetch(url):
+            resultado = obtener_imagen_instagram(url)
+            if not resultado:
+                raise ExtractionError('No se pudo extraer la imagen')
+            return resultado
+
+        def process(resultado):
+            return finalizar_post(resultado, host, noop)
+    elif tipo == 'carousel':
+        # The page visit, downloads and OCR all happen in procesar_carrusel
+        def fetch(url):
+            return procesar_carrusel(url, host)
+
+        def process(resultado):
+            return resultado
+    else:
+        def fetch(url):
+            return descargar_imagen(url, noop) + (url,)
+
+        def process(fetched):
+            img, content, url = fetched
+            return texto_de_imagen(img, content, noop, source_url=url)
+
+    return run_batch(
+        urls, fetch, process,
+        max_workers=batch_settings['max_workers'],
+        limiter=HostLimiter(batch_settings['per_host'])
+    )
 
 @app.route('/extract-image', methods=['POST'])
 def extract_image():
@@ -191,54 +537,47 @@ def extract_image():
         return jsonify({'error': 'URL no proporcionada'}), 400
     
     try:
-        img = obtener_imagen_instagram(data['url'])
-        if img:
-            # Create a temporary file while preserving original image quality
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg', dir=temp_dir) as temp_file:
-                # Save with maximum quality (100) and original dimensions
-                img.save(temp_file, 'JPEG', quality=100, optimize=True, progressive=True)
-                temp_filename = os.path.basename(temp_file.name)
-            
-            image_url = f'http://{request.host}/download/{temp_filename}'
-            logger.info(f'Imagen guardada con dimensiones originales: {img.width}x{img.height}')
-            
-            # Extract text using pytesseract
-            try:
-                # Convert image to RGB if it's not
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Extract text in Spanish and English
-                text = pytesseract.image_to_string(img, lang='spa+eng')
-                
-                if text and text.strip():
-                    logger.info(f'Successfully extracted text: {text[:100]}...')  # Log first 100 chars
-                    save_extracted_text(text)
-                else:
-                    logger.info('No text was extracted from the image')
-            except Exception as e:
-                logger.error(f'Error extracting text: {str(e)}', exc_info=True)
-                # Continue even if text extraction fails - we still want to return the image
-            
-            return jsonify({
-                'success': True,
-                'image_url': image_url
-            })
-        else:
-            return jsonify({'error': 'No se pudo extraer la imagen'}), 500
+        return jsonify(procesar_post(data['url'], request.host))
+    except ExtractionError as e:
+        return jsonify({'error': str(e)}), 500
     except Exception as e:
         logger.error(f'Error processing image: {str(e)}', exc_info=True)
         return jsonify({'error': f'Error al procesar la imagen: {str(e)}'}), 500
 
+@app.route('/extract-carousel', methods=['POST'])
+def extract_carousel():
+    data = request.get_json(silent=True)
+    if not data or 'url' not in data:
+        return jsonify({'error': 'URL no proporcionada'}), 400
+
+    try:
+        return jsonify(procesar_carrusel(data['url'], request.host))
+    except ExtractionError as e:
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        logger.error(f'Error processing carousel: {str(e)}', exc_info=True)
+        return jsonify({'error': f'Error al procesar el carrusel: {str(e)}'}), 500
+
 # Route to serve downloaded images
 @app.route('/download/<filename>')
 def download_file(filename):
     try:
-        file_path = os.path.join(temp_dir, filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, mimetype='image/jpeg')
-        else:
+        # Looked up in the store's in-memory index, not on disk
+        file_path = image_store.path_for(filename)
+        if file_path is None:
+            # Files saved before the content-addressed store, directly in temp/
+            if LEGACY_IMAGE_RE.match(filename) and os.path.exists(os.path.join(temp_dir, filename)):
+                return send_from_directory(temp_dir, filename, mimetype='image/jpeg')
             return jsonify({'error': 'File not found'}), 404
+
+        # Conditional requests get a 304 and Range requests a 206 from send_file
+        response = send_file(file_path, conditional=True, etag=image_store.etag_for(filename),
+                             max_age=IMAGE_MAX_AGE)
+        response.headers['Cache-Control'] = f'public, max-age={IMAGE_MAX_AGE}, immutable'
+        return response
+    except FileNotFoundError:
+        # Evicted between the index lookup and the read
+        return jsonify({'error': 'File not found'}), 404
     except Exception as e:
         logger.error(f'Error serving file {filename}: {str(e)}')
         return jsonify({'error': 'Error serving file'}), 500
@@ -259,41 +598,7 @@ def extract_text():
         if not data or 'image_url' not in data:
             return jsonify({'success': False, 'error': 'No se proporcionó la URL de la imagen'}), 400
         
-        image_url = data['image_url']
-        logger.info(f'Processing image URL: {image_url}')
-        
-        # Download the image
-        response = requests.get(image_url, stream=True)
-        response.raise_for_status()
-        
-        # Open the image
-        img = Image.open(BytesIO(response.content))
-        
-        # Convert to RGB if needed (required by pytesseract)
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-            
-        # Extract text using pytesseract
-        text = pytesseract.image_to_string(img, lang='spa+eng')
-        
-        # Clean up the extracted text
-        text = text.strip()
-        
-        if not text:
-            return jsonify({
-                'success': False,
-                'error': 'No se pudo extraer texto de la imagen'
-            })
-            
-        logger.info(f'Successfully extracted text: {text[:100]}...')
-        
-        # Save the extracted text
-        save_extracted_text(text)
-        
-        return jsonify({
-            'success': True,
-            'text': text
-        })
+        return jsonify(procesar_imagen_url(data['image_url']))
         
     except requests.exceptions.RequestException as e:
         logger.error(f'Error downloading image: {str(e)}')
@@ -308,77 +613,219 @@ def extract_text():
             'error': f'Error al procesar la imagen: {str(e)}'
         }), 500
 
+@app.route('/extract-batch', methods=['POST'])
+def extract_batch():
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data.get('urls'), list) or not data['urls']:
+        return jsonify({'success': False, 'error': 'No se proporcionó una lista de URLs'}), 400
+    if len(data['urls']) > batch_settings['max_items']:
+        return jsonify({
+            'success': False,
+            'error': f"El lote supera el máximo de {batch_settings['max_items']} URLs"
+        }), 400
+    tipo = data.get('type', 'image')
+    if tipo not in ('image', 'post', 'carousel'):
+        return jsonify({'success': False, 'error': "type debe ser 'image', 'post' o 'carousel'"}), 400
+
+    resultados = extraer_lote(data['urls'], tipo=tipo, host=request.host)
+    # One JSON object per line, flushed as each item finishes
+    return Response(
+        stream_with_context(json.dumps(r, ensure_ascii=False) + '\n' for r in resultados),
+        mimetype='application/x-ndjson'
+    )
+
+# Asynchronous job API: submit returns a job ID, the pipeline runs in the background
+@app.route('/jobs/extract-image', methods=['POST'])
+def submit_extract_image_job():
+    data = request.get_json(silent=True)
+    if not data or 'url' not in data:
+        return jsonify({'success': False, 'error': 'URL no proporcionada'}), 400
+    return _submit_job('extract-image', procesar_post, data['url'], request.host, url=data['url'])
+
+@app.route('/jobs/extract-carousel', methods=['POST'])
+def submit_extract_carousel_job():
+    data = request.get_json(silent=True)
+    if not data or 'url' not in data:
+        return jsonify({'success': False, 'error': 'URL no proporcionada'}), 400
+    return _submit_job('extract-carousel', procesar_carrusel, data['url'], request.host, url=data['url'])
+
+@app.route('/jobs/extract-text', methods=['POST'])
+def submit_extract_text_job():
+    data = request.get_json(silent=True)
+    if not data or 'image_url' not in data:
+        return jsonify({'success': False, 'error': 'No se proporcionó la URL de la imagen'}), 400
+    return _submit_job('extract-text', procesar_imagen_url, data['image_url'], image_url=data['image_url'])
+
+def _submit_job(kind, fn, *args, **params):
+    try:
+        job = job_manager.submit(kind, fn, *args, **params)
+    except JobQueueFull as e:
+        return jsonify({'success': False, 'error': f'Demasiados trabajos pendientes: {str(e)}'}), 429
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': f'http://{request.host}/jobs/{job.id}',
+        'events_url': f'http://{request.host}/jobs/{job.id}/events'
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Trabajo no encontrado'}), 404
+    return Response(
+        stream_with_context(job_manager.stream(job)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def preparar_analisis(model, full=False, clusters=None):
+    """Decide how to bring the analysis up to date with the stored corpus.
+
+    Returns a dict with the ``mode`` (``cached``, ``incremental``,
+    ``full`` or ``clusters``), the compacted ``entradas`` to send and their ``tokens``, a ``construir`` function that
+    wraps them in the final prompt, the cache ``key``, the ``last_id``
+    the result will cover, and ``output`` when a cached answer exists.
+    With ``clusters`` only the texts of those topic clusters are sent.
+    """
+    last_id = text_store.max_id()
+    state = analysis_cache.get_state(model)
+    if clusters:
+        preparado = prompt_prep.prepare(
+            text_store.entries_by_id(topic_clusters.entry_ids(clusters)),
+            context=text_store.iter_entries(), **prompt_settings)
+        plan = {
+            'mode': 'clusters',
+            'construir': analisis.build_prompt
+        }
+    elif state and not full and state[0] == last_id:
+        # Nothing new since the last analysis
+        return {'mode': 'cached', 'output': state[1], 'last_id': last_id, 'new_entries': 0}
+    elif state and not full and state[0] < last_id:
+        previo = state[1]
+        # Mastheads are detected over the whole corpus, not just the delta
+        preparado = prompt_prep.prepare(
+            text_store.iter_entries(after_id=state[0]), context=text_store.iter_entries(), **prompt_settings)
+        plan = {
+            'mode': 'incremental',
+            'construir': lambda texto: analisis.build_update_prompt(previo, texto)
+        }
+    else:
+        preparado = prompt_prep.prepare(text_store.iter_entries(), **prompt_settings)
+        plan = {
+            'mode': 'full',
+            'construir': analisis.build_prompt
+        }
+    plan['entradas'] = preparado['entries']
+    plan['tokens'] = {'before': preparado['tokens_before'], 'after': preparado['tokens_after']}
+    plan['new_entries'] = len(plan['entradas'])
+    logger.info(f"Prompt prepared: {preparado['tokens_before']} -> {preparado['tokens_after']} tokens, "
+                f"{preparado['duplicates']} duplicates collapsed, {preparado['truncated']} entries over budget")
+    plan['key'] = prompt_key(model, plan['construir'](''.join(plan['entradas'])))
+    plan['last_id'] = last_id
+    plan['output'] = analysis_cache.get_output(plan['key'])
+    return plan
+
+def guardar_analisis(plan, model, output):
+    """Cache a model answer; only whole-corpus analyses advance the model's state"""
+    if plan['mode'] == 'clusters':
+        analysis_cache.save_output(plan['key'], model, output)
+    else:
+        analysis_cache.save(plan['key'], model, output, plan['last_id'])
+
+def clusters_solicitados(valor, version=None):
+    """Parse the requested topic cluster ids (a list or "1,2,3"); None for the whole corpus.
+
+    Raises ValueError when the ids are invalid or the clusters were
+    rebuilt since ``version`` was read from /topics.
+    """
+    if valor in (None, '', []):
+        return None
+    if topic_clusters is None:
+        raise ValueError('La agrupación local está desactivada (TOPIC_CLUSTERS=0)')
+    if isinstance(valor, str):
+        valor = valor.split(',')
+    if not isinstance(valor, list):
+        raise ValueError('clusters debe ser una lista de identificadores')
+    try:
+        ids = [int(v) for v in valor]
+    except (TypeError, ValueError):
+        raise ValueError('clusters debe ser una lista de identificadores')
+    if version not in (None, '') and str(version) != str(topic_clusters.version):
+        raise ValueError('Los grupos cambiaron desde la consulta; vuelve a pedir /topics')
+    if not topic_clusters.entry_ids(ids):
+        raise ValueError('Los grupos indicados no tienen textos')
+    return ids
+
+def prompt_final(plan, model):
+    """Build the prompt for a plan, summarizing chunks first if it is over budget"""
+    start = time.perf_counter()
+    texto, plan['chunks'] = chunked_analyzer.condensar(plan['entradas'], model=model)
+    if plan['chunks']:
+        # Only count condensation that actually called the model
+        metrics.observe('llm', time.perf_counter() - start)
+    return plan['construir'](texto)
+
 @app.route('/analyze-texts', methods=['POST'])
 def analyze_texts():
     try:
-        # Ensure the text file exists
-        if not os.path.exists(text_file_path):
-            return jsonify({
-                'success': False,
-                'error': 'No hay textos extraídos para analizar'
-            }), 400
-            
-        # Check if file has content (more than just the header)
-        with open(text_file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            
-        if len(content) <= 50:  # Just the header or empty
+        # The header-only check on the old text file becomes a row count
+        if text_store.count() == 0:
             return jsonify({
                 'success': False,
                 'error': 'No hay suficiente texto para analizar'
             }), 400
-        
-        # Get the path to the Gemini script
-        current_dir = os.path.dirname(os.path.abspath(__file__))
-        project_dir = os.path.dirname(current_dir)
-        gemini_script_path = os.path.join(project_dir, 'gemini', 'inputTxt.py')
-        
-        # Ensure the extracted_texts.txt file is copied to the gemini directory
-        gemini_text_path = os.path.join(project_dir, 'gemini', 'extracted_texts.txt')
-        
-        # Copy the extracted text file to the gemini directory
-        with open(text_file_path, 'r', encoding='utf-8') as src_file:
-            text_content = src_file.read()
-            
-        with open(gemini_text_path, 'w', encoding='utf-8') as dest_file:
-            dest_file.write(text_content)
-        
-        logger.info(f'Running Gemini analysis script at: {gemini_script_path}')
-        
-        # Run the Gemini script
+
+        data = request.get_json(silent=True) or {}
         try:
-            # Use subprocess to run the Python script
-            result = subprocess.run(
-                [sys.executable, gemini_script_path],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            
-            # Get the output from the script
-            output = result.stdout
-            
-            # Extract the analysis part from the output
-            analysis_start = output.find("Respuesta del modelo:")
-            if analysis_start != -1:
-                analysis_text = output[analysis_start:]
-            else:
-                analysis_text = output
-                
-            logger.info(f'Gemini analysis completed successfully')
-            
-            return jsonify({
-                'success': True,
-                'analysis': analysis_text
-            })
-            
-        except subprocess.CalledProcessError as e:
-            logger.error(f'Error running Gemini script: {str(e)}')
-            logger.error(f'Script stderr: {e.stderr}')
-            return jsonify({
-                'success': False,
-                'error': f'Error al ejecutar el análisis: {e.stderr}'
-            }), 500
+            clusters = clusters_solicitados(data.get('clusters'), data.get('version'))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        model = analisis.get_model()
+        plan = preparar_analisis(model, full=bool(data.get('full')), clusters=clusters)
+        logger.info(f"Analysis mode: {plan['mode']} ({plan['new_entries']} new entries)")
+
+        if plan['output'] is not None:
+            analysis_text = plan['output']
+        else:
+            try:
+                prompt = prompt_final(plan, model)
+                with timed('llm'):
+                    analysis_text = completar_con_reintentos(
+                        prompt, model=model, max_retries=chunked_analyzer.max_retries,
+                        backoff=chunked_analyzer.backoff)
+            except analisis.AnalysisConfigError as e:
+                logger.error(f'Analysis is not configured: {str(e)}')
+                return jsonify({
+                    'success': False,
+                    'error': f'Error al ejecutar el análisis: {str(e)}'
+                }), 500
+            guardar_analisis(plan, model, analysis_text)
+
+        logger.info(f'Gemini analysis completed successfully')
+
+        return jsonify({
+            'success': True,
+            'analysis': analysis_text,
+            'mode': plan['mode'],
+            'new_entries': plan['new_entries'],
+            'chunks': plan.get('chunks', 0),
+            'tokens': plan.get('tokens')
+        })
             
     except Exception as e:
         logger.error(f'Error analyzing texts: {str(e)}', exc_info=True)
@@ -387,30 +834,114 @@ def analyze_texts():
             'error': f'Error al analizar los textos: {str(e)}'
         }), 500
 
+@app.route('/analyze-texts/stream', methods=['GET', 'POST'])
+def analyze_texts_stream():
+    """Relay the model's answer over Server-Sent Events as tokens arrive"""
+    if text_store.count() == 0:
+        return jsonify({
+            'success': False,
+            'error': 'No hay suficiente texto para analizar'
+        }), 400
+
+    try:
+        clusters = clusters_solicitados(request.args.get('clusters'), request.args.get('version'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    model = analisis.get_model()
+    plan = preparar_analisis(model, full=request.args.get('full') == '1', clusters=clusters)
+
+    def eventos():
+        try:
+            if plan['output'] is not None:
+                deltas = [plan['output']]
+            else:
+                prompt = prompt_final(plan, model)
+                llm_start = time.perf_counter()
+                deltas = analisis.completar_stream(prompt, model=model)
+            meta = {
+                'mode': plan['mode'],
+                'new_entries': plan['new_entries'],
+                'chunks': plan.get('chunks', 0),
+                'tokens': plan.get('tokens')
+            }
+            yield f"event: meta\ndata: {json.dumps(meta)}\n\n"
+            partes = []
+            for delta in deltas:
+                partes.append(delta)
+                yield f"event: token\ndata: {json.dumps({'delta': delta}, ensure_ascii=False)}\n\n"
+            if plan['output'] is None:
+                # Includes time the client took to read the stream
+                metrics.observe('llm', time.perf_counter() - llm_start)
+                guardar_analisis(plan, model, ''.join(partes))
+            yield 'event: done\ndata: {}\n\n'
+        except Exception as e:
+            logger.error(f'Error streaming analysis: {str(e)}', exc_info=True)
+            yield f"event: error\ndata: {json.dumps({'error': str(e)}, ensure_ascii=False)}\n\n"
+
+    return Response(
+        stream_with_context(eventos()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/topics')
+def topics():
+    """Topic clusters of the stored texts with their top terms, computed locally"""
+    if topic_clusters is None:
+        return jsonify({'success': False, 'error': 'La agrupación local está desactivada (TOPIC_CLUSTERS=0)'}), 404
+    start = time.perf_counter()
+    try:
+        top_terms = min(max(int(request.args.get('terms', 8)), 1), 50)
+        min_size = max(int(request.args.get('min_size', 1)), 1)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'terms y min_size deben ser números enteros'}), 400
+    resultado = topic_clusters.clusters(top_terms=top_terms, min_size=min_size)
+    return jsonify(dict(resultado, success=True, elapsed_ms=round((time.perf_counter() - start) * 1000, 2)))
+
+@app.route('/cache-stats')
+def cache_stats():
+    return jsonify({
+        'resolution_cache': image_resolver.cache.stats if image_resolver.cache else None,
+        'ocr_cache': ocr_cache.snapshot(),
+        'image_store': image_store.usage(),
+        'downloader': downloader.snapshot()
+    })
+
 @app.route('/download-texts')
 def download_texts():
+    """Stream the stored texts, filtered and formatted by the query string.
+
+    ``since``/``until`` (dates), ``source`` (part of the source URL),
+    ``q`` (full-text search), ``format`` (txt, ndjson, csv), ``compress``
+    (gzip, zstd) and ``after`` (the X-Export-Cursor of a previous export)
+    """
     try:
-        # Ensure the file exists (create empty if it doesn't)
-        if not os.path.exists(text_file_path):
-            with open(text_file_path, 'w', encoding='utf-8') as f:
-                f.write('Archivo de textos extraídos\n' + '=' * 30 + '\n\n')
-            
-        # Check if file has content (more than just the header)
-        with open(text_file_path, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            
-        if len(content) <= 50:  # Just the header or empty
+        if text_store.count() == 0:
             return jsonify({'error': 'No se han extraído textos aún'}), 404
-            
-        return send_file(
-            text_file_path,
-            mimetype='text/plain; charset=utf-8',
-            as_attachment=True,
-            download_name='textos_extraidos.txt'
-        )
+
+        try:
+            chunks, mimetype, headers = export_response(text_store, request.args)
+        except ExportError as e:
+            return jsonify({'error': str(e)}), 400
+        return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
     except Exception as e:
         logger.error(f'Error serving text file: {str(e)}', exc_info=True)
         return jsonify({'error': f'Error al descargar los textos: {str(e)}'}), 500
 
-if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+@app.route('/texts/stats')
+def texts_stats():
+    return jsonify(dict(text_store.stats(), success=True))
+
+@app.route('/search')
+def search_texts():
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = min(100, max(1, int(request.args.get('per_page', 20))))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'page y per_page deben ser enteros'}), 400
+    try:
+        results = text_store.search(request.args.get('q', ''), page=page, per_page=per_page)
+        return jsonify(dict(results, success=True))
+    except Exception as e:
+        logger.error(f'Error searching texts: {str(e)}', exc_info=True)
+        return jsonify({'success': False, 'error': f'Error al buscar: {str(e)}'}), 500
@@ -0,0 +1,376 @@
+"""Asyncio service mode for the extractor API.
+
+Run with::
+
+    uvicorn asgi_app:app --port 5000
+
+The extraction routes (/extract-image, /extract-text) and /download-texts
+run natively on the event loop. Their network I/O (the post page fetch of
+the resolver's HTTP tier and the image downloads) goes through an
+``httpx.AsyncClient``; only the work with no async API (the Selenium
+browser tier, OCR, decoding and SQLite) is offloaded to a bounded thread
+pool, and OCR itself still runs in the OCR engine's process pool. Every
+other route, including /analyze-texts and /download/<filename>, is served
+by the Flask app in ``app.py`` through a WSGI adapter, so both modes
+expose the same API and share the same pools, caches and stores.
+
+The native routes record the same request metrics and sampled log lines
+as the Flask hooks. A request that asks to be profiled is handed to the
+Flask app, whose hooks profile it on a single thread.
+"""
+import asyncio
+import contextlib
+import hmac
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.datastructures import Headers, QueryParams
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as flask_app
+from export import ExportError, export_response
+from image_resolver import HTTP_TIMEOUT, find_image_in_html, resolve_via_browser
+import metrics
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Selenium, OCR, image decoding and SQLite calls block; they run here instead of on the loop
+blocking_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('ASGI_BLOCKING_WORKERS', '32')), thread_name_prefix='asgi-blocking')
+
+
+async def offload(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(blocking_executor, fn, *args)
+
+
+def noop(stage):
+    pass
+
+
+class AsyncDownloader:
+    """asyncio counterpart of downloader.Downloader.
+
+    Shares the synchronous downloader's size cap, Content-Type check,
+    statistics and conditional-GET cache, so both serving modes warm the
+    same store. httpx only limits connections globally, so the per-host
+    limit is enforced with one semaphore per host.
+    """
+
+    def __init__(self, downloader):
+        self.base = downloader
+        connect_timeout, read_timeout = downloader.timeout
+        self.client = httpx.AsyncClient(
+            headers=dict(downloader.session.headers),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=downloader.pool_hosts * downloader.per_host),
+            follow_redirects=True,
+        )
+        self._host_slots = {}
+
+    def _slot(self, url):
+        host = urlsplit(url).netloc
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = asyncio.Semaphore(self.base.per_host)
+        return slot
+
+    async def fetch(self, url):
+        """Download ``url``; raises httpx.HTTPStatusError or DownloadRejected like the sync client"""
+        with timed('download'):
+            return await self._fetch(url)
+
+    async def _fetch(self, url):
+        cached, headers = self.base.conditional_headers(url)
+        evicted = False
+        async with self._slot(url):
+            async with self.client.stream('GET', url, headers=headers) as response:
+                if response.status_code == 304 and cached:
+                    content = await offload(self.base.read_cached, cached)
+                    if content is not None:
+                        self.base.count('not_modified')
+                        return content
+                    self.base.forget(url)
+                    evicted = True
+                else:
+                    response.raise_for_status()
+                    content_type = self.base.check_headers(response.headers)
+                    buffer = bytearray()
+                    async for chunk in response.aiter_bytes(64 * 1024):
+                        buffer.extend(chunk)
+                        self.base.check_size(len(buffer))
+                    content = bytes(buffer)
+        if evicted:
+            # The stored copy was evicted; fall back to a full download
+            return await self._fetch(url)
+        await offload(self.base.finish, url, response.headers, content_type, content)
+        return content
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+downloader = AsyncDownloader(flask_app.downloader)
+
+
+async def resolve(url, use_cache=True):
+    """Async version of ImageResolver.resolve: cache, then the HTTP tier on
+    the async client, then the browser tier in the thread pool"""
+    resolver = flask_app.image_resolver
+    start = time.perf_counter()
+    if resolver.cache is not None and use_cache:
+        # The SQLite backend reads from disk
+        img_url = await offload(resolver.cache.get, url)
+        if img_url:
+            return resolver.result(img_url, 'cache', start)
+
+    result = None
+    if resolver.http_enabled:
+        connect_timeout, read_timeout = HTTP_TIMEOUT
+        try:
+            async with downloader._slot(url):
+                with timed('page_load'):
+                    response = await downloader.client.get(
+                        url, timeout=httpx.Timeout(read_timeout, connect=connect_timeout))
+                    response.raise_for_status()
+            img_url = find_image_in_html(response.text)
+            if img_url:
+                result = resolver.result(img_url, 'http', start)
+            else:
+                logger.info(f'HTTP tier found no image for {url}, falling back to browser')
+        except httpx.HTTPError as e:
+            logger.info(f'HTTP tier failed for {url}: {str(e)}, falling back to browser')
+
+    if result is None:
+        img_url = await offload(resolve_via_browser, url, resolver.browser_pool, resolver.wait_timeout)
+        result = resolver.result(img_url, 'browser', start)
+    if resolver.cache is not None:
+        await offload(resolver.cache.put, url, result['img_url'])
+    return result
+
+
+async def obtener_imagen_instagram(url):
+    """Async version of app.obtener_imagen_instagram; None on failure"""
+    try:
+        resolucion = await resolve(url)
+        img_url = resolucion['img_url']
+        if not img_url:
+            raise Exception("La URL de la imagen está vacía")
+
+        try:
+            content = await downloader.fetch(img_url)
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            if resolucion['tier'] != 'cache' or status not in (403, 404):
+                raise
+            # La URL del CDN en caché caducó: invalidar y volver a resolver
+            logger.info(f'Cached image URL returned {status}, re-resolving {url}')
+            await offload(flask_app.image_resolver.invalidate, url)
+            resolucion = await resolve(url, use_cache=False)
+            content = await downloader.fetch(resolucion['img_url'])
+
+        img = await offload(flask_app.decodificar, content)
+        logger.info(f'Imagen descargada - Dimensiones originales: {img.width}x{img.height}')
+        return dict(resolucion, image=img, content=content, source_url=url)
+    except Exception as e:
+        logger.error(f'Error al obtener la imagen: {str(e)}')
+        return None
+
+
+async def request_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def extract_image(request):
+    data = await request_json(request)
+    if not data or 'url' not in data:
+        return JSONResponse({'error': 'URL no proporcionada'}, status_code=400)
+
+    try:
+        resultado = await obtener_imagen_instagram(data['url'])
+        if not resultado:
+            raise flask_app.ExtractionError('No se pudo extraer la imagen')
+        host = request.headers.get('host', 'localhost:5000')
+        return JSONResponse(await offload(flask_app.finalizar_post, resultado, host, noop))
+    except flask_app.ExtractionError as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+    except Exception as e:
+        logger.error(f'Error processing image: {str(e)}', exc_info=True)
+        return JSONResponse({'error': f'Error al procesar la imagen: {str(e)}'}, status_code=500)
+
+
+async def extract_text(request):
+    data = await request_json(request)
+    if not data or 'image_url' not in data:
+        return JSONResponse({'success': False, 'error': 'No se proporcionó la URL de la imagen'}, status_code=400)
+
+    image_url = data['image_url']
+    try:
+        content = await downloader.fetch(image_url)
+        img = await offload(flask_app.decodificar, content)
+        return JSONResponse(await offload(flask_app.texto_de_imagen, img, content, noop, image_url))
+    except (httpx.HTTPError, requests.exceptions.RequestException) as e:
+        # DownloadRejected is a RequestException, as in the Flask route
+        logger.error(f'Error downloading image: {str(e)}')
+        return JSONResponse({
+            'success': False,
+            'error': f'Error al descargar la imagen: {str(e)}'
+        }, status_code=400)
+    except Exception as e:
+        logger.error(f'Error processing image: {str(e)}', exc_info=True)
+        return JSONResponse({
+            'success': False,
+            'error': f'Error al procesar la imagen: {str(e)}'
+        }, status_code=500)
+
+
+async def download_texts(request):
+    try:
+        if await offload(flask_app.text_store.count) == 0:
+            return JSONResponse({'error': 'No se han extraído textos aún'}, status_code=404)
+        try:
+            chunks, mimetype, headers = await offload(export_response, flask_app.text_store, request.query_params)
+        except ExportError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+        # Starlette pulls a sync iterator from its thread pool, chunk by chunk
+        return StreamingResponse(chunks, media_type=mimetype, headers=headers)
+    except Exception as e:
+        logger.error(f'Error serving text file: {str(e)}', exc_info=True)
+        return JSONResponse({'error': f'Error al descargar los textos: {str(e)}'}, status_code=500)
+
+
+def _profile_requested(headers, query):
+    # Same trigger and token check as app.start_profile
+    profiling = flask_app.profiling
+    if not profiling['enabled']:
+        return False
+    flag = headers.get('X-Profile') or query.get('profile')
+    token = profiling['token']
+    return bool(flag and flag != '0') and (
+        not token or hmac.compare_digest(headers.get('X-Admin-Token', ''), token))
+
+
+class RequestObserver:
+    """ASGI middleware giving a native route the Flask app's request hooks.
+
+    Records REQUEST_SECONDS under ``route`` and writes the same sampled
+    JSON log line as app.after_request. Profiled requests are passed to
+    the Flask app instead: the profilers follow one thread, and there the
+    whole request runs on one.
+    """
+
+    def __init__(self, app, route):
+        self.app = app
+        self.route = route
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        headers = Headers(scope=scope)
+        if _profile_requested(headers, QueryParams(scope['query_string'])):
+            return await wsgi_app(scope, receive, send)
+
+        start = time.perf_counter()
+        state = {'status': 500, 'elapsed': None, 'bytes': None, 'json': False}
+        log_request = (flask_app.LOG_BODIES
+                       and int(headers.get('content-length') or 0) <= 64 * flask_app.LOG_BODY_MAX)
+        request_body, response_body = bytearray(), bytearray()
+
+        async def receive_logged():
+            message = await receive()
+            if log_request and message['type'] == 'http.request':
+                request_body.extend(message.get('body', b''))
+            return message
+
+        async def send_observed(message):
+            if message['type'] == 'http.response.start':
+                # Like Flask's after_request: measured when the response starts, not when a stream ends
+                state['elapsed'] = time.perf_counter() - start
+                state['status'] = message['status']
+                response_headers = Headers(raw=message['headers'])
+                length = response_headers.get('content-length')
+                state['bytes'] = int(length) if length else None
+                state['json'] = response_headers.get('content-type', '').startswith('application/json')
+            elif message['type'] == 'http.response.body' and flask_app.LOG_BODIES and state['json']:
+                response_body.extend(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_logged, send_observed)
+        finally:
+            self._record(scope, start, state, request_body, response_body)
+
+    def _record(self, scope, start, state, request_body, response_body):
+        elapsed = state['elapsed'] if state['elapsed'] is not None else time.perf_counter() - start
+        metrics.REQUEST_SECONDS.observe(elapsed, self.route, state['status'])
+
+        elapsed_ms = elapsed * 1000
+        if (state['status'] < 400 and elapsed_ms < flask_app.LOG_SLOW_MS
+                and random.random() >= flask_app.LOG_SAMPLE_RATE):
+            return
+        entry = {
+            'method': scope['method'],
+            'route': self.route,
+            'path': scope['path'],
+            'status': state['status'],
+            'ms': round(elapsed_ms, 1),
+            'bytes': state['bytes'],
+        }
+        if request_body:
+            entry['request_body'] = flask_app._truncate(bytes(request_body))
+        if response_body:
+            entry['response_body'] = flask_app._truncate(bytes(response_body))
+        logger.info(json.dumps(entry, ensure_ascii=False))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    flask_app.browser_pool.warm_up()
+    yield
+    await downloader.aclose()
+    blocking_executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Flask adds CORS headers to its own routes; the native ones get them here.
+# Preflight OPTIONS requests do not match these POST routes and fall
+# through to Flask, which answers them.
+cors = Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['GET', 'POST', 'DELETE', 'OPTIONS'],
+                  allow_headers=['Content-Type'], expose_headers=['X-Export-Cursor'])
+
+
+def native(path, endpoint, methods):
+    # CORS outermost, so a profiled request handed to Flask still gets its headers once
+    return Route(path, endpoint, methods=methods, middleware=[cors, Middleware(RequestObserver, route=path)])
+
+
+wsgi_app = WSGIMiddleware(flask_app.app, workers=int(os.getenv('ASGI_WSGI_WORKERS', '16')))
+
+app = Starlette(
+    routes=[
+        native('/extract-image', extract_image, ['POST']),
+        native('/extract-text', extract_text, ['POST']),
+        native('/download-texts', download_texts, ['GET']),
+        Mount('/', app=wsgi_app),
+    ],
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host=os.getenv('ASGI_HOST', '127.0.0.1'), port=int(os.getenv('ASGI_PORT', '5000')))
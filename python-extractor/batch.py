@@ -0,0 +1,84 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class HostLimiter:
+    """Caps the number of concurrent network fetches per host"""
+
+    def __init__(self, per_host=4):
+        self.per_host = per_host
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, url):
+        host = (urlsplit(url).hostname or '').lower()
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = self._semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return semaphore
+
+    def acquire(self, url, timeout=None):
+        """Take a slot for ``url``'s host; False if none came free within ``timeout`` seconds"""
+        return self._semaphore(url).acquire(timeout=timeout)
+
+    def release(self, url):
+        self._semaphore(url).release()
+
+    @contextmanager
+    def slot(self, url):
+        self.acquire(url)
+        try:
+            yield
+        finally:
+            self.release(url)
+
+
+def run_batch(urls, fetch, process, max_workers=8, limiter=None):
+    """Fetch and process every URL concurrently, yielding results as they finish.
+
+    ``fetch(url)`` does the network work and runs under the per-host limit;
+    ``process(fetched)`` does the CPU work (OCR), which the OCR engine
+    spreads across cores. Each yielded dict carries the item's ``index``
+    and ``url`` plus either the ``process`` result or ``success: False``
+    and an ``error``, so one bad URL never fails the whole batch.
+    """
+    limiter = limiter or HostLimiter()
+
+    def run_one(url):
+        with limiter.slot(url):
+            fetched = fetch(url)
+        return process(fetched)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='batch')
+    try:
+        futures = {executor.submit(run_one, url): (index, url) for index, url in enumerate(urls)}
+        for future in as_completed(futures):
+            index, url = futures[future]
+            try:
+                result = dict(future.result())
+            except Exception as e:
+                logger.error(f'Batch item {index} ({url}) failed: {str(e)}')
+                result = {'success': False, 'error': str(e)}
+            result.update(index=index, url=url)
+            yield result
+    finally:
+        # If the consumer stops early (client disconnected) drop pending items
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def batch_settings_from_env():
+    """Batch limits configured through BATCH_* variables"""
+    return {
+        'max_workers': int(os.getenv('BATCH_MAX_WORKERS', '8')),
+        'per_host': int(os.getenv('BATCH_PER_HOST', '4')),
+        'max_items': int(os.getenv('BATCH_MAX_ITEMS', '200')),
+        # Images of one carousel post downloaded and OCR'd at the same time
+        'carousel_workers': int(os.getenv('CAROUSEL_MAX_WORKERS', '4')),
+    }
@@ -0,0 +1,355 @@
+"""Offline benchmark for the extractor API.
+
+Starts local stand-ins for everything the extractor talks to:
+
+- a fake Instagram post page carrying both an og:image tag and the ``img``
+  markup matched by ``image_resolver.SELECTORES``;
+- a static "CDN" serving the sample JPEGs in ``temp/`` (with
+  Last-Modified, so conditional GETs get 304s);
+- a fake OpenAI-compatible ``/v1/chat/completions`` endpoint.
+
+The Flask app is then served on a local port, with every store in a
+throwaway directory, and each scenario is driven at the requested
+concurrency. Latency percentiles, throughput and the per-stage breakdown
+from /metrics are written to a JSON file that can be compared across runs::
+
+    python benchmark.py --requests 40 --concurrency 8 --output bench.json
+    python benchmark.py --compare bench_before.json bench.json
+
+OCR still needs a Tesseract binary; the browser resolver tier (``--resolver
+browser``) needs Chrome.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAMPLE_DIR = os.path.join(HERE, 'temp')
+SCENARIOS = ('extract-image', 'extract-text', 'analyze')
+
+POST_PAGE = '''<!DOCTYPE html>
+<html><head>
+<meta property="og:image" content="{img_url}">
+<title>Benchmark post {post_id}</title>
+</head><body>
+<article><div class="_aagv"><img alt="Photo by benchmark" src="{img_url}"></div></article>
+</body></html>
+'''
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Fake post pages, CDN and chat completions, all on one port"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', content_type='text/plain', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        stub = self.server.stub
+        match = re.match(r'^/p/(\d+)/?$', self.path)
+        if match:
+            post_id = int(match.group(1))
+            name = stub['images'][post_id % len(stub['images'])]
+            page = POST_PAGE.format(img_url=f"{stub['base']}/cdn/{name}", post_id=post_id)
+            return self._send(200, page.encode('utf-8'), 'text/html; charset=utf-8')
+
+        match = re.match(r'^/cdn/([\w.-]+)$', self.path)
+        if match and match.group(1) in stub['images']:
+            time.sleep(stub['cdn_latency'])
+            path = os.path.join(SAMPLE_DIR, match.group(1))
+            mtime = int(os.path.getmtime(path))
+            since = self.headers.get('If-Modified-Since')
+            if since:
+                try:
+                    if parsedate_to_datetime(since).timestamp() >= mtime:
+                        return self._send(304)
+                except (TypeError, ValueError):
+                    pass
+            with open(path, 'rb') as f:
+                body = f.read()
+            return self._send(200, body, 'image/jpeg', {'Last-Modified': formatdate(mtime, usegmt=True)})
+
+        self._send(404, b'not found')
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            return self._send(404, b'not found')
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(self.server.stub['llm_latency'])
+        text = 'Línea de tiempo de prueba generada por el servidor de benchmark.'
+        model = request.get('model', 'benchmark')
+        if not request.get('stream'):
+            body = {
+                'id': 'bench', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': text}}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0},
+            }
+            return self._send(200, json.dumps(body).encode('utf-8'), 'application/json')
+
+        events = []
+        for word in text.split(' '):
+            chunk = {'id': 'bench', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                     'choices': [{'index': 0, 'delta': {'content': word + ' '}, 'finish_reason': None}]}
+            events.append(f'data: {json.dumps(chunk)}\n\n')
+        events.append('data: [DONE]\n\n')
+        self._send(200, ''.join(events).encode('utf-8'), 'text/event-stream')
+
+
+def start_stub_server(cdn_latency=0.0, llm_latency=0.0):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.stub = {
+        'base': f'http://127.0.0.1:{server.server_port}',
+        'images': sorted(name for name in os.listdir(SAMPLE_DIR) if name.lower().endswith('.jpg')),
+        'cdn_latency': cdn_latency,
+        'llm_latency': llm_latency,
+    }
+    threading.Thread(target=server.serve_forever, name='bench-stubs', daemon=True).start()
+    return server
+
+
+def configure_env(workdir, stub_base, args):
+    """Point every store at ``workdir`` and every external call at the stubs"""
+    env = {
+        'BROWSER_POOL_PRELAUNCH': '0',
+        'TEXT_STORE_PATH': os.path.join(workdir, 'texts.sqlite3'),
+        'ANALYSIS_CACHE_PATH': os.path.join(workdir, 'analysis.sqlite3'),
+        'OCR_CACHE_DIR': os.path.join(workdir, 'ocr_cache'),
+        'IMAGE_STORE_DIR': os.path.join(workdir, 'images'),
+        'RESOLUTION_CACHE_BACKEND': 'memory',
+        'RESOLVER_HTTP_TIER': '0' if args.resolver == 'browser' else '1',
+        'OPENROUTER_API_KEY': 'benchmark',
+        'OPENROUTER_BASE_URL': f'{stub_base}/v1',
+        'LOG_SAMPLE_RATE': '0',
+        'LOG_SLOW_MS': '1e12',
+    }
+    if args.cold:
+        # Every request pays for resolution, download and OCR
+        env.update({'OCR_CACHE_MAX_BYTES': '0', 'DOWNLOAD_CONDITIONAL': '0', 'RESOLUTION_CACHE_TTL': '0'})
+    os.environ.update(env)
+
+
+def start_app_server():
+    from werkzeug.serving import make_server
+
+    sys.path.insert(0, HERE)
+    import app as extractor
+    server = make_server('127.0.0.1', 0, extractor.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return extractor, server
+
+
+_SUM_RE = re.compile(r'^extractor_stage_seconds_(sum|count)\{stage="([^"]+)"\} ([0-9.e+-]+)$')
+
+
+def stage_totals(base):
+    totals = {}
+    for line in requests.get(f'{base}/metrics', timeout=10).text.splitlines():
+        match = _SUM_RE.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            totals.setdefault(stage, {'sum': 0.0, 'count': 0})[kind] = float(value)
+    return totals
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def build_request(scenario, i, stub, extractor, run_id):
+    """Return ``(method, path, json_body)`` for request ``i`` of a scenario"""
+    if scenario == 'extract-image':
+        return 'POST', '/extract-image', {'url': f"{stub['base']}/p/{run_id * 100000 + i}/"}
+    if scenario == 'extract-text':
+        name = stub['images'][i % len(stub['images'])]
+        return 'POST', '/extract-text', {'image_url': f"{stub['base']}/cdn/{name}"}
+    # A new entry per request, so each analysis makes an incremental model call.
+    # The words are random enough that SimHash dedup never merges two entries
+    words = ' '.join(hashlib.sha256(f'{run_id}-{i}-{k}'.encode()).hexdigest()[:8] for k in range(8))
+    extractor.text_store.add(f'Entrada de benchmark {run_id}-{i}: {words}.')
+    return 'POST', '/analyze-texts', {}
+
+
+def run_scenario(scenario, base, stub, extractor, requests_count, concurrency, run_id):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+
+    def one(i):
+        method, path, body = build_request(scenario, i, stub, extractor, run_id)
+        start = time.perf_counter()
+        try:
+            response = session.request(method, base + path, json=body, timeout=600)
+            ok = response.status_code < 400
+        except requests.exceptions.RequestException:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    before = stage_totals(base)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(one, range(requests_count)))
+    duration = time.perf_counter() - started
+    after = stage_totals(base)
+
+    latencies = [elapsed * 1000 for elapsed, ok in results if ok]
+    stages = {}
+    for stage, totals in after.items():
+        previous = before.get(stage, {'sum': 0.0, 'count': 0})
+        count = int(totals['count'] - previous['count'])
+        if count:
+            seconds = totals['sum'] - previous['sum']
+            stages[stage] = {
+                'count': count,
+                'total_s': round(seconds, 4),
+                'mean_ms': round(seconds * 1000 / count, 2),
+                'per_request_ms': round(seconds * 1000 / requests_count, 2),
+            }
+    return {
+        'requests': requests_count,
+        'concurrency': concurrency,
+        'errors': sum(1 for _, ok in results if not ok),
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(requests_count / duration, 2) if duration else None,
+        'latency_ms': {
+            'p50': _round(percentile(latencies, 50)),
+            'p95': _round(percentile(latencies, 95)),
+            'p99': _round(percentile(latencies, 99)),
+            'mean': _round(statistics.mean(latencies)) if latencies else None,
+            'max': _round(max(latencies)) if latencies else None,
+        },
+        'stages': stages,
+    }
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(old_path, new_path):
+    """Print how each scenario changed between two result files"""
+    with open(old_path, 'r', encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"{'scenario':<15}{'metric':<16}{'before':>12}{'after':>12}{'change':>10}")
+    for scenario, result in new['scenarios'].items():
+        previous = old['scenarios'].get(scenario)
+        if not previous:
+            continue
+        rows = [('throughput_rps', previous['throughput_rps'], result['throughput_rps'])]
+        rows += [(f'{p} ms', previous['latency_ms'][p], result['latency_ms'][p]) for p in ('p50', 'p95', 'p99')]
+        for metric, before, after in rows:
+            change = f'{(after - before) / before * 100:+.1f}%' if before and after is not None else '-'
+            print(f'{scenario:<15}{metric:<16}{before if before is not None else "-":>12}'
+                  f'{after if after is not None else "-":>12}{change:>10}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark for the extractor API')
+    parser.add_argument('--scenarios', default='extract-image,extract-text',
+                        help=f"Comma-separated, from: {', '.join(SCENARIOS)}")
+    parser.add_argument('--requests', type=int, default=40, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per scenario')
+    parser.add_argument('--cold', action='store_true', help='Disable the OCR, download and resolution caches')
+    parser.add_argument('--resolver', choices=('http', 'browser'), default='http')
+    parser.add_argument('--cdn-latency', type=float, default=0.0, help='Seconds added to each CDN response')
+    parser.add_argument('--llm-latency', type=float, default=0.2, help='Seconds added to each model call')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='Compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix='extractor-bench-')
+    stubs = start_stub_server(args.cdn_latency, args.llm_latency)
+    configure_env(workdir, stubs.stub['base'], args)
+    extractor, app_server = start_app_server()
+    base = f'http://127.0.0.1:{app_server.server_port}'
+
+    results = {}
+    try:
+        for run_id, scenario in enumerate(scenarios, 1):
+            if args.warmup:
+                run_scenario(scenario, base, stubs.stub, extractor, args.warmup, 1, run_id + 1000)
+            print(f'Running {scenario}: {args.requests} requests at concurrency {args.concurrency}')
+            results[scenario] = run_scenario(
+                scenario, base, stubs.stub, extractor, args.requests, args.concurrency, run_id)
+            latency = results[scenario]['latency_ms']
+            print(f"  {results[scenario]['throughput_rps']} req/s, p50 {latency['p50']} ms, "
+                  f"p95 {latency['p95']} ms, p99 {latency['p99']} ms, errors {results[scenario]['errors']}")
+    finally:
+        app_server.shutdown()
+        stubs.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'git_revision': git_revision(),
+        'settings': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'warmup': args.warmup,
+            'cold': args.cold,
+            'resolver': args.resolver,
+            'cdn_latency': args.cdn_latency,
+            'llm_latency': args.llm_latency,
+            'ocr_workers': extractor.ocr_engine.workers,
+        },
+        'scenarios': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
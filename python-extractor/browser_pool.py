@@ -0,0 +1,199 @@
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+
+class BrowserPoolTimeout(Exception):
+    """Raised when no browser becomes available within the queue timeout"""
+
+
+def build_chrome_options():
+    """Headless Chrome options shared by every pooled driver"""
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--disable-dev-shm-usage")
+    chrome_options.add_argument("--window-size=1920,1080")
+
+    # Configurar el navegador para parecer más real
+    chrome_options.add_argument(f"user-agent={USER_AGENT}")
+    return chrome_options
+
+
+class _PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+
+
+class BrowserPool:
+    """Bounded pool of pre-launched headless Chrome drivers.
+
+    Drivers are checked out with ``pool.driver()`` and returned when the
+    block exits. With ``prelaunch`` the pool is filled in the background by
+    ``warm_up()``, called by the serving process once it starts (or by the
+    first checkout), so processes that only import the app never launch
+    Chrome. A driver is recycled after ``max_uses`` checkouts, when it
+    fails its health check, or when the block raises a WebDriverException.
+    """
+
+    def __init__(self, size=2, max_uses=50, queue_timeout=30, prelaunch=True):
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self.queue_timeout = queue_timeout
+        self._idle = queue.LifoQueue()
+        # Limits the number of live drivers (idle + checked out)
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {'launched': 0, 'recycled': 0, 'checkouts': 0, 'timeouts': 0}
+        self.prelaunch = prelaunch
+        self._warming = False
+
+    def warm_up(self):
+        """Launch the pool's drivers in the background, once; no-op without ``prelaunch``"""
+        with self._lock:
+            if not self.prelaunch or self._warming or self._closed:
+                return
+            self._warming = True
+        threading.Thread(target=self._prelaunch, name='browser-pool-warmup', daemon=True).start()
+
+    def _launch(self):
+        with timed('browser_launch'):
+            driver = webdriver.Chrome(options=build_chrome_options())
+        with self._lock:
+            self.stats['launched'] += 1
+        logger.info('Browser pool: launched new Chrome driver')
+        return _PooledDriver(driver)
+
+    def _prelaunch(self):
+        for _ in range(self.size):
+            if not self._slots.acquire(blocking=False):
+                break
+            try:
+                pooled = self._launch()
+            except Exception as e:
+                self._slots.release()
+                logger.error(f'Browser pool: warm-up launch failed: {str(e)}')
+                break
+            if not self._keep(pooled):
+                # close() ran while Chrome was starting
+                self._discard(pooled)
+                break
+
+    def _keep(self, pooled):
+        """Return a driver to the idle queue unless the pool has been closed"""
+        with self._lock:
+            if self._closed:
+                return False
+            self._idle.put(pooled)
+            return True
+
+    def _healthy(self, pooled):
+        try:
+            pooled.driver.execute_script('return 1')
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, pooled):
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+        with self._lock:
+            self.stats['recycled'] += 1
+        self._slots.release()
+
+    def _acquire(self):
+        # Prefer an idle warm driver, otherwise launch one if a slot is free,
+        # otherwise wait for a driver to be returned or a slot to be released.
+        self.warm_up()
+        deadline = time.monotonic() + self.queue_timeout
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            if self._slots.acquire(blocking=False):
+                try:
+                    return self._launch()
+                except Exception:
+                    self._slots.release()
+                    raise
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                with self._lock:
+                    self.stats['timeouts'] += 1
+                raise BrowserPoolTimeout(
+                    f'No hay navegadores disponibles tras {self.queue_timeout}s de espera')
+            try:
+                return self._idle.get(timeout=min(remaining, 0.25))
+            except queue.Empty:
+                continue
+
+    @contextmanager
+    def driver(self):
+        """Check out a healthy driver for the duration of the block"""
+        if self._closed:
+            raise RuntimeError('Browser pool is closed')
+        pooled = self._acquire()
+        while not self._healthy(pooled):
+            logger.warning('Browser pool: driver failed health check, recycling')
+            self._discard(pooled)
+            pooled = self._acquire()
+
+        pooled.uses += 1
+        with self._lock:
+            self.stats['checkouts'] += 1
+        broken = False
+        try:
+            yield pooled.driver
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            if broken or pooled.uses >= self.max_uses:
+                self._discard(pooled)
+            else:
+                try:
+                    pooled.driver.delete_all_cookies()
+                except Exception:
+                    pass
+                if not self._keep(pooled):
+                    self._discard(pooled)
+
+    def close(self):
+        """Quit every idle driver; checked-out and still-launching drivers are quit when they come back"""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                pooled = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(pooled)
+
+
+def pool_from_env():
+    """Build a BrowserPool configured through BROWSER_POOL_* variables"""
+    return BrowserPool(
+        size=int(os.getenv('BROWSER_POOL_SIZE', '2')),
+        max_uses=int(os.getenv('BROWSER_POOL_MAX_USES', '50')),
+        queue_timeout=float(os.getenv('BROWSER_POOL_QUEUE_TIMEOUT', '30')),
+        prelaunch=os.getenv('BROWSER_POOL_PRELAUNCH', '1') == '1',
+    )
@@ -0,0 +1,81 @@
+import hashlib
+import re
+import threading
+import unicodedata
+
+HASH_BITS = 64
+
+
+def normalize_text(text):
+    """Lowercase, strip accents and punctuation so OCR noise like
+    "pierde’34,000" and "pierde 34,000" normalize to the same string"""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r'[^\w]+', ' ', text.lower(), flags=re.UNICODE)
+    return ' '.join(text.split())
+
+
+def _features(text, k=4):
+    normalized = normalize_text(text)
+    if len(normalized) <= k:
+        return [normalized] if normalized else []
+    return [normalized[i:i + k] for i in range(len(normalized) - k + 1)]
+
+
+def simhash(text):
+    """64-bit SimHash over character 4-gram shingles of the normalized text"""
+    weights = [0] * HASH_BITS
+    for feature in _features(text):
+        value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(HASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    result = 0
+    for bit in range(HASH_BITS):
+        if weights[bit] > 0:
+            result |= 1 << bit
+    return result
+
+
+def to_signed(value):
+    """Map an unsigned 64-bit hash into SQLite's signed INTEGER range"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class SimHashIndex:
+    """Finds stored texts whose SimHash is within ``max_distance`` bits.
+
+    Hashes are split into ``max_distance + 1`` bands; by the pigeonhole
+    principle any hash within the distance shares at least one band
+    exactly, so only texts in the matching buckets are compared.
+    """
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self._bands = max_distance + 1
+        self._width = HASH_BITS // self._bands
+        self._buckets = [dict() for _ in range(self._bands)]
+        self._lock = threading.Lock()
+
+    def _keys(self, value):
+        mask = (1 << self._width) - 1
+        return [(value >> (band * self._width)) & mask for band in range(self._bands)]
+
+    def add(self, item_id, value):
+        with self._lock:
+            for band, key in enumerate(self._keys(value)):
+                self._buckets[band].setdefault(key, []).append((item_id, value))
+
+    def find(self, value):
+        """Return ``(item_id, distance)`` of the closest match, or None"""
+        best = None
+        with self._lock:
+            for band, key in enumerate(self._keys(value)):
+                for item_id, other in self._buckets[band].get(key, ()):
+                    distance = (value ^ other).bit_count()
+                    if distance <= self.max_distance and (best is None or distance < best[1]):
+                        best = (item_id, distance)
+        return best
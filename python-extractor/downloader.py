@@ -0,0 +1,208 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from batch import HostLimiter
+from browser_pool import USER_AGENT
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Content-Type -> PIL format name, so cached bodies share ImageStore names
+# with the copies finalizar_post stores
+IMAGE_FORMATS = {'image/jpeg': 'JPEG', 'image/png': 'PNG', 'image/webp': 'WEBP', 'image/gif': 'GIF'}
+# CDNs sometimes label images generically; anything else is refused
+GENERIC_TYPES = ('application/octet-stream', 'binary/octet-stream')
+
+
+class DownloadRejected(requests.exceptions.RequestException):
+    """The response is too large or is not an image"""
+
+
+class PoolTimeout(requests.exceptions.ConnectionError):
+    """No connection to the host came free within ``pool_timeout``"""
+
+
+class Downloader:
+    """Shared HTTP layer for image downloads.
+
+    One ``requests.Session`` keeps connections alive across requests, with
+    at most ``per_host`` connections to any host. Extra requests wait for
+    a free one, for at most ``pool_timeout`` seconds before failing with
+    PoolTimeout (urllib3's own blocking pool would wait forever). Bodies are streamed and abandoned once they exceed
+    ``max_bytes``; a Content-Type that is not an image is refused before
+    the body is read.
+
+    With a ``store`` (an ImageStore), responses carrying an ETag or
+    Last-Modified are kept there and the validators remembered per URL, so
+    a repeat download becomes a conditional GET answered by a 304.
+    """
+
+    def __init__(self, max_bytes=20 * 1024 * 1024, connect_timeout=3.05, read_timeout=10,
+                 pool_hosts=16, per_host=8, pool_timeout=10, store=None, cache_entries=5000):
+        self.max_bytes = max_bytes
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_hosts = pool_hosts
+        self.per_host = per_host
+        self.pool_timeout = pool_timeout
+        self.store = store
+        self.cache_entries = cache_entries
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        # The host limiter keeps each pool within per_host, so the pool never has to block
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=per_host, pool_block=False)
+        self._hosts = HostLimiter(per_host)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        # url -> {'etag', 'last_modified', 'filename'}
+        self._validators = OrderedDict()
+        self.stats = {'downloads': 0, 'not_modified': 0, 'rejected': 0, 'pool_timeouts': 0, 'bytes': 0}
+
+    def fetch(self, url):
+        """Download ``url`` and return its body as bytes.
+
+        Raises ``requests.HTTPError`` for error statuses (the response is
+        attached), DownloadRejected for oversized or non-image bodies and
+        PoolTimeout when the host has no free connection in time.
+        """
+        with timed('download'):
+            return self._fetch(url)
+
+    def _fetch(self, url):
+        cached, headers = self.conditional_headers(url)
+        evicted = False
+        with self._slot(url), self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+            if response.status_code == 304 and cached:
+                content = self.read_cached(cached)
+                if content is not None:
+                    self.count('not_modified')
+                    return content
+                self.forget(url)
+                evicted = True
+            else:
+                response.raise_for_status()
+                content_type = self.check_headers(response.headers)
+                buffer = bytearray()
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    buffer.extend(chunk)
+                    self.check_size(len(buffer))
+                content = bytes(buffer)
+        if evicted:
+            # The stored copy was evicted; fall back to a full download once the
+            # 304 has released its connection and host slot
+            return self._fetch(url)
+
+        self.finish(url, response.headers, content_type, content)
+        return content
+
+    @contextmanager
+    def _slot(self, url):
+        if not self._hosts.acquire(url, timeout=self.pool_timeout):
+            self.count('pool_timeouts')
+            raise PoolTimeout(f'No hay conexión libre hacia {url} tras {self.pool_timeout}s')
+        try:
+            yield
+        finally:
+            self._hosts.release(url)
+
+    # The helpers below are shared with the ASGI service's async client
+
+    def conditional_headers(self, url):
+        """Return ``(cached, headers)``: the remembered validators for ``url`` as request headers"""
+        cached = self._cached(url)
+        headers = {}
+        if cached:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        return cached, headers
+
+    def check_headers(self, headers):
+        """Refuse non-image Content-Types and announced oversized bodies; returns the Content-Type"""
+        content_type = headers.get('Content-Type', '').split(';')[0].strip().lower()
+        if content_type and not content_type.startswith('image/') and content_type not in GENERIC_TYPES:
+            self.count('rejected')
+            raise DownloadRejected(f'La URL no es una imagen (Content-Type: {content_type})')
+        length = headers.get('Content-Length')
+        if length and length.isdigit():
+            self.check_size(int(length))
+        return content_type
+
+    def check_size(self, size):
+        if size > self.max_bytes:
+            self.count('rejected')
+            raise DownloadRejected(f'La imagen supera el límite de {self.max_bytes} bytes')
+
+    def finish(self, url, headers, content_type, content):
+        """Count a completed download and remember its validators"""
+        self.count('downloads', len(content))
+        self._remember(url, headers, content_type, content)
+
+    def count(self, key, size=0):
+        with self._lock:
+            self.stats[key] += 1
+            self.stats['bytes'] += size
+
+    def _cached(self, url):
+        if self.store is None:
+            return None
+        with self._lock:
+            entry = self._validators.get(url)
+            if entry is not None:
+                self._validators.move_to_end(url)
+            return entry
+
+    def read_cached(self, cached):
+        """Body of a 304 response from the store, or None if it was evicted"""
+        path = self.store.path_for(cached['filename'])
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _remember(self, url, headers, content_type, content):
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if self.store is None or not (etag or last_modified):
+            return
+        filename = self.store.put(content, IMAGE_FORMATS.get(content_type))
+        with self._lock:
+            self._validators[url] = {'etag': etag, 'last_modified': last_modified, 'filename': filename}
+            self._validators.move_to_end(url)
+            while len(self._validators) > self.cache_entries:
+                self._validators.popitem(last=False)
+
+    def forget(self, url):
+        with self._lock:
+            self._validators.pop(url, None)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, cached_urls=len(self._validators))
+
+
+def downloader_from_env(store=None):
+    """Build a Downloader configured through DOWNLOAD_* variables.
+
+    DOWNLOAD_CONDITIONAL=0 disables conditional GETs against ``store``.
+    """
+    return Downloader(
+        max_bytes=int(os.getenv('DOWNLOAD_MAX_BYTES', str(20 * 1024 * 1024))),
+        connect_timeout=float(os.getenv('DOWNLOAD_CONNECT_TIMEOUT', '3.05')),
+        read_timeout=float(os.getenv('DOWNLOAD_READ_TIMEOUT', '10')),
+        pool_hosts=int(os.getenv('DOWNLOAD_POOL_HOSTS', '16')),
+        per_host=int(os.getenv('DOWNLOAD_PER_HOST', '8')),
+        pool_timeout=float(os.getenv('DOWNLOAD_POOL_TIMEOUT', '10')),
+        store=store if os.getenv('DOWNLOAD_CONDITIONAL', '1') == '1' else None,
+        cache_entries=int(os.getenv('DOWNLOAD_CACHE_ENTRIES', '5000')),
+    )
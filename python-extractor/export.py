@@ -0,0 +1,175 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+
+from text_store import LEGACY_HEADER, TIMESTAMP_FORMAT, format_legacy_entry
+
+try:
+    import zstandard
+except ImportError:  # optional: only needed for compress=zstd
+    zstandard = None
+
+# format -> (mimetype, file extension); Flask and Starlette add the utf-8
+# charset to text/* types themselves
+FORMATS = {
+    'txt': ('text/plain', 'txt'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+# compression -> (mimetype, file extension)
+COMPRESSIONS = {
+    'gzip': ('application/gzip', 'gz'),
+    'zstd': ('application/zstd', 'zst'),
+}
+CSV_COLUMNS = ['id', 'created_at', 'source_url', 'image_hash', 'ocr_tier', 'ocr_confidence', 'text']
+# Rendered text is handed to the compressor/response in chunks of about this size
+CHUNK_SIZE = 64 * 1024
+
+
+class ExportError(ValueError):
+    """Invalid export parameters"""
+
+
+def parse_timestamp(value, end=False):
+    """Accept ``YYYY-MM-DD`` or ``YYYY-MM-DD HH:MM:SS`` (or ISO ``T``).
+
+    A bare date used as the end of the window covers that whole day.
+    """
+    if not value:
+        return None
+    value = value.strip().replace('T', ' ')
+    try:
+        if len(value) == 10:
+            day = datetime.strptime(value, '%Y-%m-%d')
+            return (day + timedelta(days=1, seconds=-1) if end else day).strftime(TIMESTAMP_FORMAT)
+        return datetime.strptime(value[:19], TIMESTAMP_FORMAT).strftime(TIMESTAMP_FORMAT)
+    except ValueError:
+        raise ExportError(f'Fecha no válida: {value} (usa AAAA-MM-DD o AAAA-MM-DD HH:MM:SS)')
+
+
+def render_txt(entries, header=True):
+    if header:
+        yield LEGACY_HEADER
+    for entry in entries:
+        yield format_legacy_entry(entry)
+
+
+def render_ndjson(entries, header=True):
+    for entry in entries:
+        yield json.dumps(entry, ensure_ascii=False) + '\n'
+
+
+def render_csv(entries, header=True):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_COLUMNS, extrasaction='ignore')
+    if header:
+        writer.writeheader()
+    for entry in entries:
+        writer.writerow(entry)
+        # Hand over each row as it is written so the buffer never grows
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+RENDERERS = {'txt': render_txt, 'ndjson': render_ndjson, 'csv': render_csv}
+
+
+def _encode(pieces):
+    # Coalesce small rows into ~CHUNK_SIZE byte chunks
+    pending, size = [], 0
+    for piece in pieces:
+        data = piece.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= CHUNK_SIZE:
+            yield b''.join(pending)
+            pending, size = [], 0
+    if pending:
+        yield b''.join(pending)
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _zstd(chunks):
+    compressor = zstandard.ZstdCompressor().compressobj()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(entries, fmt='txt', compression=None, header=True):
+    """Render ``entries`` (an iterator) as byte chunks, compressed on the fly when asked"""
+    chunks = _encode(RENDERERS[fmt](entries, header=header))
+    if compression == 'gzip':
+        return _gzip(chunks)
+    if compression == 'zstd':
+        return _zstd(chunks)
+    return chunks
+
+
+def export_params(args):
+    """Validate the query parameters of /download-texts.
+
+    Returns the text store filters (``since``, ``until``, ``source``,
+    ``query``, ``after_id``) with ``fmt`` and ``compression``; raises
+    ExportError on invalid values.
+    """
+    fmt = (args.get('format') or 'txt').lower()
+    if fmt not in FORMATS:
+        raise ExportError(f"format debe ser uno de: {', '.join(FORMATS)}")
+    compression = (args.get('compress') or '').lower() or None
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ExportError(f"compress debe ser uno de: {', '.join(COMPRESSIONS)}")
+    if compression == 'zstd' and zstandard is None:
+        raise ExportError('La compresión zstd no está disponible (instala zstandard)')
+    after = args.get('after') or '0'
+    if not after.isdigit():
+        raise ExportError('after debe ser el cursor devuelto en X-Export-Cursor')
+    return {
+        'fmt': fmt,
+        'compression': compression,
+        'after_id': int(after),
+        'since': parse_timestamp(args.get('since')),
+        'until': parse_timestamp(args.get('until'), end=True),
+        'source': args.get('source') or None,
+        'query': args.get('q') or '',
+    }
+
+
+def export_response(text_store, args):
+    """Everything a route needs to stream an export: ``(chunks, mimetype, headers)``.
+
+    The export covers entries up to the newest id at request time; that
+    id is returned in X-Export-Cursor, and passing it back as ``after``
+    yields exactly the entries stored since.
+    """
+    params = export_params(args)
+    fmt, compression = params.pop('fmt'), params.pop('compression')
+    cursor = text_store.max_id()
+    entries = text_store.iter_export(up_to_id=cursor, **params)
+
+    mimetype, extension = FORMATS[fmt]
+    filename = f'textos_extraidos.{extension}'
+    if compression:
+        mimetype, suffix = COMPRESSIONS[compression]
+        filename += f'.{suffix}'
+    headers = {
+        'Content-Disposition': f'attachment; filename={filename}',
+        'X-Export-Cursor': str(cursor),
+    }
+    # An incremental slice is appended to an earlier export: no header again
+    chunks = export_stream(entries, fmt, compression, header=params['after_id'] == 0)
+    return chunks, mimetype, headers
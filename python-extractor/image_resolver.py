@@ -0,0 +1,351 @@
+import html
+import json
+import logging
+import os
+import re
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+
+from browser_pool import USER_AGENT
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Intentar diferentes selectores comunes de Instagram
+SELECTORES = [
+    "//img[contains(@alt, 'Photo by')]",  # Selector por atributo alt
+    "//div[contains(@class, 'x5yr21d')]//img",  # Selector por clase contenedora
+    "//div[contains(@class, '_aagv')]//img",  # Clase común para imágenes
+    "//article//img",  # Último recurso: cualquier imagen dentro de un artículo
+    "//img[contains(@src, 'scontent.cdninstagram.com')]"  # Selector por dominio de la imagen
+]
+
+_META_TAG_RE = re.compile(r'<meta\b[^>]*>', re.IGNORECASE)
+_ATTR_RE = re.compile(r'([\w:-]+)\s*=\s*(["\'])(.*?)\2', re.DOTALL)
+# "display_url":"https:\/\/scontent..." inside the page's embedded JSON
+_JSON_URL_RE = re.compile(r'"(?:display_url|display_src)"\s*:\s*("(?:[^"\\]|\\.)*")')
+# Size of a CDN variant: stp=dst-jpg_e35_p1080x1080 or a legacy /s640x640/ path segment
+_VARIANT_SIZE_RE = re.compile(r'(?:^|[_/])[ps](\d+)x(\d+)(?:[_/]|$)')
+# (connect, read) timeouts of the HTTP tier's page fetch
+HTTP_TIMEOUT = (3.05, 5)
+# Flecha "siguiente" del carrusel, en inglés o en español
+CAROUSEL_NEXT = "//button[@aria-label='Next' or @aria-label='Siguiente']"
+
+
+class ImageNotFound(Exception):
+    """Raised when no tier of the resolver finds the post image"""
+
+
+def _meta_content(page, prop):
+    for tag in _META_TAG_RE.findall(page):
+        attrs = {name.lower(): value for name, _, value in _ATTR_RE.findall(tag)}
+        if attrs.get('property') == prop or attrs.get('name') == prop:
+            content = attrs.get('content')
+            if content:
+                return html.unescape(content)
+    return None
+
+
+def find_image_in_html(page):
+    """Return the post image URL from og:image or embedded JSON, if present"""
+    img_url = _meta_content(page, 'og:image')
+    if img_url and img_url.startswith('http'):
+        return img_url
+
+    match = _JSON_URL_RE.search(page)
+    if match:
+        try:
+            img_url = json.loads(match.group(1))
+        except ValueError:
+            img_url = None
+        if img_url and img_url.startswith('http'):
+            return img_url
+    return None
+
+
+def image_key(url):
+    """Identity of a post image across size variants: the CDN file name.
+
+    The CDN serves the same image under different query strings and size
+    path segments, but always with the same file name.
+    """
+    path = urlsplit(url).path
+    return path.rsplit('/', 1)[-1] or url
+
+
+def variant_width(url):
+    """Width announced by a CDN variant URL, 0 when unknown"""
+    parts = urlsplit(url)
+    candidates = parse_qs(parts.query).get('stp', []) + [parts.path]
+    for candidate in candidates:
+        match = _VARIANT_SIZE_RE.search(candidate)
+        if match:
+            return int(match.group(1))
+    return 0
+
+
+class ImageSet:
+    """Distinct post images in discovery order, keeping the widest variant of each"""
+
+    def __init__(self):
+        # image_key -> (url, width)
+        self._images = {}
+
+    def add(self, url, width=None):
+        """Add ``url``; returns True if it is a new image"""
+        if not url or not url.startswith('http'):
+            return False
+        key = image_key(url)
+        width = width if width is not None else variant_width(url)
+        known = self._images.get(key)
+        if known is None:
+            self._images[key] = (url, width)
+            return True
+        if width > known[1]:
+            self._images[key] = (url, width)
+        return False
+
+    def urls(self):
+        return [url for url, _ in self._images.values()]
+
+    def __len__(self):
+        return len(self._images)
+
+
+def find_images_in_html(page):
+    """Return every post image URL in the page's embedded JSON, deduplicated.
+
+    Carousel posts list one display_url per slide (plus the cover, which
+    repeats the first slide). og:image is not used here: it only ever
+    holds the cover, so a page without the JSON cannot tell a single
+    image from a carousel.
+    """
+    images = ImageSet()
+    for match in _JSON_URL_RE.finditer(page):
+        try:
+            images.add(json.loads(match.group(1)))
+        except ValueError:
+            continue
+    return images.urls()
+
+
+def _fetch_page(url, session=None, timeout=HTTP_TIMEOUT):
+    getter = session or requests
+    with timed('page_load'):
+        response = getter.get(url, headers={'User-Agent': USER_AGENT}, timeout=timeout)
+        response.raise_for_status()
+    return response.text
+
+
+def resolve_via_http(url, session=None, timeout=HTTP_TIMEOUT):
+    """Cheap tier: fetch the post HTML and read the image URL from it"""
+    return find_image_in_html(_fetch_page(url, session, timeout))
+
+
+def _first_image_src(driver):
+    # Condición para WebDriverWait: devuelve el primer src válido o False
+    for selector in SELECTORES:
+        try:
+            for element in driver.find_elements("xpath", selector):
+                src = element.get_attribute('src')
+                if src and 'http' in src:
+                    return src
+        except Exception:
+            continue
+    return False
+
+
+def resolve_via_browser(url, browser_pool, wait_timeout=10):
+    """Browser tier: load the page and return as soon as a matching img appears"""
+    with browser_pool.driver() as driver:
+        with timed('page_load'):
+            driver.get(url)
+        try:
+            with timed('selector_match'):
+                return WebDriverWait(driver, wait_timeout, poll_frequency=0.1).until(_first_image_src)
+        except TimeoutException:
+            # Tomar captura de pantalla para depuración
+            driver.save_screenshot('debug_screenshot.png')
+            print("Se ha guardado una captura de pantalla para depuración: debug_screenshot.png")
+            raise ImageNotFound("No se pudo encontrar ningún elemento de imagen con los selectores conocidos")
+
+
+def _srcset_largest(srcset):
+    # "url 640w, url 1080w" -> (url, 1080)
+    best = (None, -1)
+    for candidate in srcset.split(','):
+        parts = candidate.strip().split()
+        if not parts:
+            continue
+        width = 0
+        if len(parts) > 1 and parts[1].endswith('w') and parts[1][:-1].isdigit():
+            width = int(parts[1][:-1])
+        if width > best[1]:
+            best = (parts[0], width)
+    return best
+
+
+def _collect_visible(driver, images):
+    """Add the post images currently in the DOM; returns how many were new"""
+    added = 0
+    for selector in SELECTORES:
+        try:
+            elements = driver.find_elements("xpath", selector)
+        except Exception:
+            continue
+        found = False
+        for element in elements:
+            try:
+                src = element.get_attribute('src')
+                srcset = element.get_attribute('srcset')
+            except Exception:
+                continue
+            if srcset:
+                url, width = _srcset_largest(srcset)
+                if url and url.startswith('http'):
+                    found = True
+                    added += images.add(url, width or None)
+                    continue
+            if src and 'http' in src:
+                found = True
+                added += images.add(src)
+        # Same priority as the single-image mode: the first selector that
+        # matches wins, so broad fallbacks do not pick up avatars
+        if found:
+            break
+    return added
+
+
+def resolve_all_via_browser(url, browser_pool, wait_timeout=10, max_slides=20, slide_timeout=1.5):
+    """Browser tier for carousels: one page visit, stepping through every slide.
+
+    After the first image appears, the carousel's "next" arrow is clicked
+    until it disappears, clicking stops revealing images or ``max_slides``
+    is reached, collecting the images rendered at each step.
+    """
+    with browser_pool.driver() as driver:
+        with timed('page_load'):
+            driver.get(url)
+        try:
+            with timed('selector_match'):
+                WebDriverWait(driver, wait_timeout, poll_frequency=0.1).until(_first_image_src)
+        except TimeoutException:
+            raise ImageNotFound("No se pudo encontrar ningún elemento de imagen con los selectores conocidos")
+
+        images = ImageSet()
+        _collect_visible(driver, images)
+        with timed('carousel_walk'):
+            clicks = idle = 0
+            # The DOM pre-renders neighbouring slides, so a click may reveal
+            # nothing new; stop only after two such clicks in a row
+            while len(images) < max_slides and clicks < max_slides and idle < 2:
+                buttons = driver.find_elements("xpath", CAROUSEL_NEXT)
+                if not buttons:
+                    break
+                try:
+                    driver.execute_script('arguments[0].click();', buttons[0])
+                    clicks += 1
+                    WebDriverWait(driver, slide_timeout, poll_frequency=0.1).until(
+                        lambda d: _collect_visible(d, images) > 0)
+                    idle = 0
+                except TimeoutException:
+                    idle += 1
+                except Exception as e:
+                    logger.info(f'Carousel navigation stopped for {url}: {str(e)}')
+                    break
+        return images.urls()[:max_slides]
+
+
+class ImageResolver:
+    """Resolve a post URL to its image URL, trying the cheapest tier first.
+
+    ``resolve`` returns a dict with ``img_url``, the ``tier`` that
+    succeeded (``cache``, ``http`` or ``browser``) and ``elapsed_ms``.
+    """
+
+    def __init__(self, browser_pool, cache=None, http_enabled=True, wait_timeout=10, session=None,
+                 max_slides=20):
+        self.browser_pool = browser_pool
+        self.cache = cache
+        self.http_enabled = http_enabled
+        self.session = session
+        self.wait_timeout = wait_timeout
+        self.max_slides = max_slides
+
+    def resolve(self, url, use_cache=True):
+        start = time.perf_counter()
+        if self.cache is not None and use_cache:
+            img_url = self.cache.get(url)
+            if img_url:
+                return self.result(img_url, 'cache', start)
+
+        result = self._resolve_uncached(url, start)
+        if self.cache is not None:
+            self.cache.put(url, result['img_url'])
+        return result
+
+    def invalidate(self, url):
+        """Forget the cached image URL for ``url`` (e.g. after a 403/404)"""
+        if self.cache is not None:
+            self.cache.invalidate(url)
+
+    def _resolve_uncached(self, url, start):
+        if self.http_enabled:
+            try:
+                img_url = resolve_via_http(url, session=self.session)
+                if img_url:
+                    return self.result(img_url, 'http', start)
+                logger.info(f'HTTP tier found no image for {url}, falling back to browser')
+            except requests.exceptions.RequestException as e:
+                logger.info(f'HTTP tier failed for {url}: {str(e)}, falling back to browser')
+
+        img_url = resolve_via_browser(url, self.browser_pool, self.wait_timeout)
+        return self.result(img_url, 'browser', start)
+
+    def resolve_all(self, url):
+        """Resolve every image of a (carousel) post with a single page load.
+
+        Returns ``img_urls`` (distinct images in slide order), ``tier`` and
+        ``elapsed_ms``. The resolution cache holds one URL per post, so it
+        is not used here.
+        """
+        start = time.perf_counter()
+        if self.http_enabled:
+            try:
+                img_urls = find_images_in_html(_fetch_page(url, self.session))
+                if img_urls:
+                    return self._result_all(img_urls[:self.max_slides], 'http', start)
+                logger.info(f'HTTP tier found no embedded images for {url}, falling back to browser')
+            except requests.exceptions.RequestException as e:
+                logger.info(f'HTTP tier failed for {url}: {str(e)}, falling back to browser')
+
+        img_urls = resolve_all_via_browser(url, self.browser_pool, self.wait_timeout, self.max_slides)
+        return self._result_all(img_urls, 'browser', start)
+
+    def _result_all(self, img_urls, tier, start):
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f'Resolved {len(img_urls)} image URL(s) via {tier} tier in {elapsed_ms} ms')
+        return {'img_urls': img_urls, 'tier': tier, 'elapsed_ms': elapsed_ms}
+
+    # Shared with the ASGI service, which runs the cache and HTTP tiers on its async client
+
+    def result(self, img_url, tier, start):
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        logger.info(f'Resolved image URL via {tier} tier in {elapsed_ms} ms')
+        return {'img_url': img_url, 'tier': tier, 'elapsed_ms': elapsed_ms}
+
+
+def resolver_from_env(browser_pool, cache=None, session=None):
+    """Build an ImageResolver configured through RESOLVER_* variables"""
+    return ImageResolver(
+        browser_pool,
+        cache=cache,
+        session=session,
+        http_enabled=os.getenv('RESOLVER_HTTP_TIER', '1') == '1',
+        wait_timeout=float(os.getenv('RESOLVER_BROWSER_WAIT_TIMEOUT', '10')),
+        max_slides=int(os.getenv('RESOLVER_CAROUSEL_MAX_SLIDES', '20')),
+    )
@@ -0,0 +1,190 @@
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+
+from ocr_cache import image_digest
+
+logger = logging.getLogger(__name__)
+
+# PIL format name -> file extension of the stored original
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+_NAME_RE = re.compile(r'^([0-9a-f]{64})\.(jpg|png|webp|gif|bin)$')
+
+
+class ImageStore:
+    """Downloaded images kept byte-for-byte under their SHA-256.
+
+    ``put`` writes the original bytes to ``<root>/ab/cd/<sha256>.<ext>``
+    (two levels of sharding keep directories small) and returns the file
+    name. Identical images share one file, and since a name always maps
+    to the same bytes, clients may cache them forever.
+
+    The store is kept within ``max_bytes`` and ``max_files``. An in-memory
+    index of every file, with its size and last access, answers lookups
+    without touching the filesystem; a background sweeper evicts the least
+    recently used files whenever a budget is exceeded.
+    """
+
+    def __init__(self, root, max_bytes=1024 * 1024 * 1024, max_files=10000, sweep_interval=60):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        # file name -> {'size': bytes, 'atime': float}
+        self._index = {}
+        self._total_bytes = 0
+        self.stats = {'stored': 0, 'reused': 0, 'evictions': 0, 'evicted_bytes': 0, 'sweeps': 0}
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._sweeper = threading.Thread(target=self._sweep_loop, name='image-store-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def _path(self, digest, ext):
+        return os.path.join(self.root, digest[:2], digest[2:4], f'{digest}.{ext}')
+
+    def _load_index(self):
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                if name.endswith('.tmp'):
+                    # Left behind by a write interrupted mid-way
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                if not _NAME_RE.match(name):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                self._index[name] = {'size': stat.st_size, 'atime': max(stat.st_atime, stat.st_mtime)}
+                self._total_bytes += stat.st_size
+
+    def put(self, data, image_format=None):
+        """Store ``data`` unless already present; returns its file name"""
+        digest = image_digest(data)
+        ext = EXTENSIONS.get(image_format, 'bin')
+        path = self._path(digest, ext)
+        name = os.path.basename(path)
+        with self._lock:
+            entry = self._index.get(name)
+            if entry is not None:
+                entry['atime'] = time.time()
+                self.stats['reused'] += 1
+                return name
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if name not in self._index:
+                self._total_bytes += len(data)
+                self.stats['stored'] += 1
+            self._index[name] = {'size': len(data), 'atime': time.time()}
+            over_budget = self._over_budget()
+        if over_budget:
+            self._wake.set()
+        return name
+
+    def path_for(self, filename):
+        """Absolute path of a stored file, or None; counts as an access for LRU"""
+        match = _NAME_RE.match(filename)
+        if not match:
+            return None
+        with self._lock:
+            entry = self._index.get(filename)
+            if entry is None:
+                return None
+            entry['atime'] = time.time()
+        return self._path(match.group(1), match.group(2))
+
+    @staticmethod
+    def etag_for(filename):
+        """The content hash in the name doubles as a strong ETag"""
+        match = _NAME_RE.match(filename)
+        return match.group(1) if match else None
+
+    def _over_budget(self):
+        return self._total_bytes > self.max_bytes or len(self._index) > self.max_files
+
+    def sweep(self):
+        """Evict least recently used files until both budgets are met; returns files removed"""
+        with self._lock:
+            self.stats['sweeps'] += 1
+            if not self._over_budget():
+                return 0
+            victims = []
+            for name, entry in sorted(self._index.items(), key=lambda item: item[1]['atime']):
+                if not self._over_budget():
+                    break
+                del self._index[name]
+                self._total_bytes -= entry['size']
+                victims.append((name, entry['size']))
+
+        # Unlink outside the lock so downloads are not held up by disk I/O
+        for name, size in victims:
+            match = _NAME_RE.match(name)
+            try:
+                os.remove(self._path(match.group(1), match.group(2)))
+            except OSError:
+                pass
+            with self._lock:
+                self.stats['evictions'] += 1
+                self.stats['evicted_bytes'] += size
+        if victims:
+            logger.info(f'Image store: evicted {len(victims)} files')
+        return len(victims)
+
+    def _sweep_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.sweep_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f'Image store sweep failed: {str(e)}')
+
+    def usage(self):
+        """Files and bytes against the budgets, plus free space on the volume"""
+        disk = shutil.disk_usage(self.root)
+        with self._lock:
+            return dict(
+                self.stats,
+                files=len(self._index),
+                bytes=self._total_bytes,
+                max_files=self.max_files,
+                max_bytes=self.max_bytes,
+                disk_total=disk.total,
+                disk_free=disk.free,
+            )
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+
+
+def image_store_from_env(default_dir):
+    """Open the ImageStore configured through IMAGE_STORE_* variables.
+
+    IMAGE_STORE_DIR defaults to ``images`` in ``default_dir``.
+    """
+    return ImageStore(
+        os.getenv('IMAGE_STORE_DIR') or os.path.join(default_dir, 'images'),
+        max_bytes=int(os.getenv('IMAGE_STORE_MAX_BYTES', str(1024 * 1024 * 1024))),
+        max_files=int(os.getenv('IMAGE_STORE_MAX_FILES', '10000')),
+        sweep_interval=float(os.getenv('IMAGE_STORE_SWEEP_INTERVAL', '60')),
+    )
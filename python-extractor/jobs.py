@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = ('succeeded', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+    """Raised inside a job's pipeline when the client cancelled it"""
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already waiting to run"""
+
+
+class Job:
+    def __init__(self, kind, params):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = 'queued'
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.events = []
+        self._cond = threading.Condition()
+        self._cancel = threading.Event()
+        self.future = None
+
+    def _emit(self, event, **data):
+        with self._cond:
+            self.events.append({'event': event, 'data': dict(data, status=self.status, stage=self.stage)})
+            self._cond.notify_all()
+
+    def _set_status(self, status, event, **fields):
+        """Move to ``status`` and emit ``event`` under one lock.
+
+        A stream that sees the event also sees the status and timestamps it
+        announces. Once the job is finished further changes are ignored;
+        returns whether this one applied.
+        """
+        with self._cond:
+            if self.status in TERMINAL_STATES:
+                return False
+            self.status = status
+            for name, value in fields.items():
+                setattr(self, name, value)
+            if status == 'running':
+                self.started_at = time.time()
+            elif status in TERMINAL_STATES:
+                self.finished_at = time.time()
+            self._emit(event)
+            return True
+
+    def report(self, stage):
+        """Progress callback handed to the pipeline; aborts if cancelled"""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self.stage = stage
+        self._emit('progress')
+
+    def wait_events(self, after, timeout):
+        """Block until there are events past index ``after`` or timeout"""
+        with self._cond:
+            if len(self.events) <= after and self.status not in TERMINAL_STATES:
+                self._cond.wait(timeout)
+            return self.events[after:]
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'type': self.kind,
+            'status': self.status,
+            'stage': self.stage,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class JobManager:
+    """Runs extraction pipelines on a bounded worker pool.
+
+    ``submit`` returns immediately with a Job; the pipeline callable is
+    invoked as ``fn(*args, progress=job.report)`` on a worker thread.
+    Finished jobs are kept for ``retention`` seconds so clients can poll
+    for results, and at most ``max_pending`` jobs may wait for a worker.
+    """
+
+    def __init__(self, max_workers=4, max_pending=100, retention=3600):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retention = retention
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, **params):
+        with self._lock:
+            self._purge()
+            pending = sum(1 for job in self._jobs.values() if job.status == 'queued')
+            if pending >= self.max_pending:
+                raise JobQueueFull(f'Hay {pending} trabajos en cola')
+            job = Job(kind, params)
+            self._jobs[job.id] = job
+        job._emit('queued')
+        job.future = self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job, fn, args):
+        # Cancelled too late for future.cancel() but before the pipeline started
+        if job._cancel.is_set():
+            job._set_status('cancelled', 'cancelled')
+            return
+        job._set_status('running', 'started')
+        try:
+            result = fn(*args, progress=job.report)
+        except JobCancelled:
+            job._set_status('cancelled', 'cancelled')
+        except Exception as e:
+            logger.error(f'Job {job.id} failed: {str(e)}', exc_info=True)
+            job._set_status('failed', 'failed', error=str(e))
+        else:
+            job._set_status('succeeded', 'succeeded', result=result)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Request cancellation; queued jobs never start, running ones stop at the next stage"""
+        job = self.get(job_id)
+        if job is None or job.status in TERMINAL_STATES:
+            return job
+        job._cancel.set()
+        if job.future is not None and job.future.cancel():
+            job._set_status('cancelled', 'cancelled')
+        return job
+
+    def stream(self, job, keepalive=15):
+        """Yield Server-Sent Events for ``job`` until it finishes"""
+        index = 0
+        while True:
+            events = job.wait_events(index, keepalive)
+            if not events:
+                yield ': keepalive\n\n'
+            for event in events:
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+            index += len(events)
+            if job.status in TERMINAL_STATES and index >= len(job.events):
+                yield f"event: result\ndata: {json.dumps(job.to_dict())}\n\n"
+                return
+
+    def _purge(self):
+        cutoff = time.time() - self.retention
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def jobs_from_env():
+    """Build a JobManager configured through JOBS_* variables"""
+    return JobManager(
+        max_workers=int(os.getenv('JOBS_MAX_WORKERS', '4')),
+        max_pending=int(os.getenv('JOBS_MAX_PENDING', '100')),
+        retention=float(os.getenv('JOBS_RETENTION', '3600')),
+    )
@@ -0,0 +1,260 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def image_digest(data):
+    """Content address of the raw image bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+# Side of the grayscale thumbnail that confirms perceptual matches
+THUMBNAIL_SIZE = 32
+
+
+def perceptual_hash(img):
+    """64-bit difference hash (dHash); re-encoded copies land within a few bits"""
+    small = img.convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def thumbnail(img):
+    """32x32 grayscale thumbnail, base64-encoded for the JSON entry"""
+    small = img.convert('L').resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.LANCZOS)
+    return base64.b64encode(small.tobytes()).decode('ascii')
+
+
+def thumbnail_difference(a, b):
+    """Largest per-pixel difference between two thumbnails (0-255).
+
+    Re-encoding or rescaling moves every pixel by a few levels at most; a
+    changed headline moves the pixels it covers by far more.
+    """
+    return max(abs(x - y) for x, y in zip(base64.b64decode(a), base64.b64decode(b)))
+
+
+def params_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+class OCRCache:
+    """Content-addressed OCR result cache on disk.
+
+    Each entry is a small JSON file named after the SHA-256 of the image
+    bytes and holding the text, the OCR parameters, the image's perceptual
+    hash and a 32x32 grayscale thumbnail. Exact byte matches are looked up
+    by name first. Re-encoded copies are found by comparing perceptual
+    hashes within ``max_distance`` bits, then confirmed by a thumbnail
+    differing by at most ``max_pixel_difference`` levels anywhere: cards
+    from one outlet share a layout and logo, so the 64-bit hash alone
+    would hand one headline's text to another. The store is trimmed to
+    ``max_bytes`` by evicting the least recently used entries.
+    """
+
+    def __init__(self, cache_dir, max_bytes=64 * 1024 * 1024, max_distance=4, max_pixel_difference=12):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_distance = max_distance
+        self.max_pixel_difference = max_pixel_difference
+        self._lock = threading.Lock()
+        # digest -> {'params': key, 'phash': int, 'size': bytes, 'atime': float}
+        self._index = {}
+        self._total_bytes = 0
+        self.stats = {'exact_hits': 0, 'perceptual_hits': 0, 'perceptual_rejects': 0, 'misses': 0, 'evictions': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, digest):
+        return os.path.join(self.cache_dir, f'{digest}.json')
+
+    def _load_index(self):
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                stat = os.stat(path)
+                indexed = {
+                    'params': entry['params'],
+                    'phash': int(entry['phash']),
+                    'size': stat.st_size,
+                    'atime': stat.st_mtime,
+                }
+            except (OSError, ValueError, KeyError, TypeError):
+                logger.warning(f'OCR cache: skipping malformed entry {name}')
+                continue
+            self._index[name[:-5]] = indexed
+            self._total_bytes += stat.st_size
+
+    def _read(self, digest):
+        try:
+            with open(self._path(digest), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if isinstance(entry, dict) and 'text' in entry else None
+
+    def _hit(self, digest, indexed, stat, confirm=None):
+        """Read the entry file outside the lock; count the hit or drop the broken entry.
+
+        ``confirm``, when given, must accept the stored entry for it to count.
+        """
+        cached = self._read(digest)
+        if cached is not None and confirm is not None and not confirm(cached):
+            with self._lock:
+                self.stats['perceptual_rejects'] += 1
+            return None
+        now = time.time()
+        with self._lock:
+            current = self._index.get(digest)
+            if cached is None:
+                # Unless a concurrent put already replaced it
+                dropped = current is indexed and self._drop(digest)
+            else:
+                if current is not None:
+                    current['atime'] = now
+                self.stats[stat] += 1
+        if cached is None:
+            if dropped:
+                self._unlink(digest)
+            return None
+        try:
+            os.utime(self._path(digest), (now, now))
+        except OSError:
+            pass
+        return cached
+
+    def get(self, data, img, params):
+        """Return cached text for these image bytes and OCR params, or None"""
+        entry = self.get_entry(data, img, params)
+        return entry['text'] if entry else None
+
+    def get_entry(self, data, img, params):
+        """Like ``get`` but return the stored entry, including its ``meta``"""
+        digest = image_digest(data)
+        key = params_key(params)
+        # The lock only guards the index; hashing and file reads happen outside it
+        with self._lock:
+            entry = self._index.get(digest)
+        if entry and entry['params'] == key:
+            cached = self._hit(digest, entry, 'exact_hits')
+            if cached is not None:
+                return cached
+
+        phash = perceptual_hash(img)
+        candidates = []
+        with self._lock:
+            for other, entry in self._index.items():
+                if entry['params'] != key:
+                    continue
+                distance = (entry['phash'] ^ phash).bit_count()
+                if distance <= self.max_distance:
+                    candidates.append((distance, other, entry))
+        if candidates:
+            small = thumbnail(img)
+
+            def confirm(cached):
+                # Entries written before thumbnails were stored only match exactly
+                try:
+                    return thumbnail_difference(cached['thumbnail'], small) <= self.max_pixel_difference
+                except (KeyError, TypeError, ValueError):
+                    return False
+
+            for _, other, entry in sorted(candidates, key=lambda candidate: candidate[0]):
+                cached = self._hit(other, entry, 'perceptual_hits', confirm)
+                if cached is not None:
+                    logger.info(f'OCR cache: perceptual match {other[:12]} for {digest[:12]}')
+                    return cached
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, data, img, params, text, meta=None):
+        """Store ``text`` plus optional ``meta`` (e.g. OCR tier and confidence)"""
+        digest = image_digest(data)
+        entry = {
+            'text': text,
+            'meta': meta or {},
+            'params': params_key(params),
+            'phash': perceptual_hash(img),
+            'thumbnail': thumbnail(img),
+            'created_at': time.time(),
+        }
+        payload = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+        # Written outside the lock; the rename makes the file appear whole
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, self._path(digest))
+        with self._lock:
+            self._drop(digest)
+            self._index[digest] = {
+                'params': entry['params'],
+                'phash': entry['phash'],
+                'size': len(payload),
+                'atime': time.time(),
+            }
+            self._total_bytes += len(payload)
+            victims = self._evict()
+        for victim in victims:
+            self._unlink(victim)
+
+    def _drop(self, digest):
+        """Remove ``digest`` from the index (lock held); its file is left to ``_unlink``"""
+        entry = self._index.pop(digest, None)
+        if entry is None:
+            return False
+        self._total_bytes -= entry['size']
+        return True
+
+    def _unlink(self, digest):
+        try:
+            os.remove(self._path(digest))
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Drop least recently used entries until within ``max_bytes`` (lock held); returns them"""
+        victims = []
+        if self._total_bytes <= self.max_bytes:
+            return victims
+        for digest, _ in sorted(self._index.items(), key=lambda item: item[1]['atime']):
+            if self._total_bytes <= self.max_bytes:
+                break
+            self._drop(digest)
+            victims.append(digest)
+            self.stats['evictions'] += 1
+        return victims
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._index), bytes=self._total_bytes)
+
+
+def ocr_cache_from_env(default_dir):
+    """Build an OCRCache configured through OCR_CACHE_* variables"""
+    return OCRCache(
+        os.getenv('OCR_CACHE_DIR', os.path.join(default_dir, 'ocr_cache')),
+        max_bytes=int(os.getenv('OCR_CACHE_MAX_BYTES', str(64 * 1024 * 1024))),
+        max_distance=int(os.getenv('OCR_CACHE_MAX_DISTANCE', '4')),
+        max_pixel_difference=int(os.getenv('OCR_CACHE_MAX_PIXEL_DIFFERENCE', '12')),
+    )
@@ -0,0 +1,196 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pytesseract
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tesserocr
+except ImportError:  # Optional binding; pytesseract is used instead
+    tesserocr = None
+
+class OCRError(Exception):
+    """OCR failure raised back to the caller.
+
+    pytesseract's own exceptions cannot be unpickled across the process
+    boundary, which would break the whole pool, so workers re-raise them
+    as this type.
+    """
+
+
+# Per-worker state, populated by _init_worker in each pool process
+_worker_apis = {}
+_worker_backend = None
+
+
+def _init_worker(backend, tesseract_cmd, tessdata_path):
+    global _worker_backend
+    _worker_backend = backend
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    if tessdata_path:
+        os.environ['TESSDATA_PREFIX'] = tessdata_path
+
+
+def _api_for(lang, tessdata=None):
+    # Models are loaded once per worker, model directory and language, then reused
+    path = tessdata or os.environ.get('TESSDATA_PREFIX')
+    api = _worker_apis.get((path, lang))
+    if api is None:
+        api = tesserocr.PyTessBaseAPI(lang=lang, path=path) if path else tesserocr.PyTessBaseAPI(lang=lang)
+        _worker_apis[(path, lang)] = api
+    return api
+
+
+def _run_ocr(img, lang, psm=None, tessdata=None, confidence=False):
+    try:
+        return _ocr(img, lang, psm, tessdata, confidence)
+    except Exception as e:
+        raise OCRError(f'{type(e).__name__}: {e}') from None
+
+
+def _ocr(img, lang, psm, tessdata, confidence):
+    # Binarized crops arrive as 'L'; Tesseract takes them without conversion
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    if _worker_backend == 'tesserocr':
+        api = _api_for(lang, tessdata)
+        api.SetPageSegMode(psm if psm is not None else tesserocr.PSM.AUTO)
+        api.SetImage(img)
+        try:
+            text = api.GetUTF8Text()
+            if not confidence:
+                return text
+            words = len(text.split())
+            return {'text': text, 'confidence': float(api.MeanTextConf()) if words else 0.0, 'words': words}
+        finally:
+            api.Clear()
+
+    config = f'--psm {psm}' if psm is not None else ''
+    if tessdata:
+        config += f' --tessdata-dir "{tessdata}"'
+    if not confidence:
+        return pytesseract.image_to_string(img, lang=lang, config=config)
+    data = pytesseract.image_to_data(img, lang=lang, config=config, output_type=pytesseract.Output.DICT)
+    return _text_from_data(data)
+
+
+def _text_from_data(data):
+    """Rebuild text and mean word confidence from image_to_data output.
+
+    One recognition pass yields both, instead of image_to_string plus
+    image_to_data. Words keep their line breaks; paragraphs are separated
+    by a blank line as image_to_string does.
+    """
+    lines, confs = [], []
+    current, words = None, []
+    for i, word in enumerate(data['text']):
+        conf = float(data['conf'][i])
+        word = (word or '').strip()
+        if conf < 0 or not word:
+            continue
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        if key != current:
+            if words:
+                lines.append((current, ' '.join(words)))
+            current, words = key, []
+        words.append(word)
+        confs.append(conf)
+    if words:
+        lines.append((current, ' '.join(words)))
+
+    text, previous = '', None
+    for key, line in lines:
+        if previous is not None:
+            text += '\n\n' if key[:2] != previous[:2] else '\n'
+        text += line
+        previous = key
+    return {
+        'text': text,
+        'confidence': sum(confs) / len(confs) if confs else 0.0,
+        'words': len(confs),
+    }
+
+
+class OCREngine:
+    """OCR backend shared by every extraction path.
+
+    Work runs in a process pool with one worker per core. Each worker keeps
+    a long-lived tesserocr API handle per language so traineddata is
+    loaded once; without tesserocr the workers call pytesseract. With
+    ``workers=0`` OCR runs inline in the calling thread.
+    """
+
+    def __init__(self, workers=None, backend='auto', tessdata_path=None):
+        if backend == 'auto':
+            backend = 'tesserocr' if tesserocr is not None else 'pytesseract'
+        if backend == 'tesserocr' and tesserocr is None:
+            raise RuntimeError('tesserocr no está instalado')
+        self.backend = backend
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.tessdata_path = tessdata_path
+        self._executor = None
+        self._lock = threading.Lock()
+        # Inline mode shares one API handle per language between threads
+        self._inline_lock = threading.Lock()
+        logger.info(f'OCR engine: backend={backend} workers={self.workers}')
+
+    def _initargs(self):
+        return (self.backend, pytesseract.pytesseract.tesseract_cmd, self.tessdata_path)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=self._initargs(),
+                )
+            return self._executor
+
+    def submit(self, img, lang='spa+eng', psm=None, tessdata=None, confidence=False):
+        """Schedule OCR of a PIL image and return a Future with the text.
+
+        With ``confidence`` the Future yields ``{'text', 'confidence',
+        'words'}`` instead, confidence being the mean word confidence
+        (0-100). ``tessdata`` overrides the model directory for this call.
+        """
+        return self._get_executor().submit(_run_ocr, img, lang, psm, tessdata, confidence)
+
+    def _inline(self, img, lang, psm, tessdata, confidence):
+        with self._inline_lock:
+            _init_worker(*self._initargs())
+            return _run_ocr(img, lang, psm, tessdata, confidence)
+
+    def image_to_string(self, img, lang='spa+eng', psm=None):
+        if self.workers == 0:
+            return self._inline(img, lang, psm, None, False)
+        return self.submit(img, lang, psm).result()
+
+    def map(self, imgs, lang='spa+eng', psm=None, tessdata=None, confidence=False):
+        """OCR several images in parallel; returns their results in order"""
+        if self.workers == 0:
+            return [self._inline(img, lang, psm, tessdata, confidence) for img in imgs]
+        futures = [self.submit(img, lang, psm, tessdata, confidence) for img in imgs]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def engine_from_env():
+    """Build an OCREngine configured through OCR_ENGINE_* variables"""
+    workers = os.getenv('OCR_ENGINE_WORKERS')
+    return OCREngine(
+        workers=int(workers) if workers else None,
+        backend=os.getenv('OCR_ENGINE_BACKEND', 'auto'),
+        tessdata_path=os.getenv('OCR_ENGINE_TESSDATA'),
+    )
@@ -0,0 +1,88 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+FAST = 'fast'
+ACCURATE = 'accurate'
+
+
+class TieredOCR:
+    """Fast OCR pass first, the accurate one only where it is needed.
+
+    Every crop is read with the fast models (``fast_tessdata``, usually a
+    tessdata_fast checkout) in a single language. Crops whose mean word
+    confidence is below ``min_confidence`` are read again with the best
+    models in ``accurate_lang``. A crop where the fast pass found no words
+    is only retried when it is the whole image, since region detection
+    also returns some non-text crops.
+
+    ``recognize`` returns ``{'text', 'tier', 'confidence'}``: the tier is
+    ``'accurate'`` when any crop was escalated, and the confidence is the
+    word-weighted mean over the final results.
+    """
+
+    def __init__(self, engine, enabled=True, fast_lang='spa', fast_tessdata=None,
+                 accurate_lang='spa+eng', min_confidence=75.0):
+        self.engine = engine
+        self.enabled = enabled
+        self.fast_lang = fast_lang
+        self.fast_tessdata = fast_tessdata
+        self.accurate_lang = accurate_lang
+        self.min_confidence = min_confidence
+
+    def params(self):
+        """OCR settings that change the output, for the OCR cache key"""
+        if not self.enabled:
+            return {'lang': self.accurate_lang}
+        return {
+            'lang': self.accurate_lang,
+            'fast_lang': self.fast_lang,
+            'fast_tessdata': self.fast_tessdata,
+            'min_confidence': self.min_confidence,
+        }
+
+    def _accurate(self, crops, psm):
+        return self.engine.map(crops, lang=self.accurate_lang, psm=psm, confidence=True)
+
+    def recognize(self, crops, psm=None):
+        if not self.enabled:
+            return _combine(self._accurate(crops, psm), ACCURATE)
+
+        results = self.engine.map(
+            crops, lang=self.fast_lang, psm=psm, tessdata=self.fast_tessdata, confidence=True)
+        retry = [i for i, result in enumerate(results)
+                 if (result['words'] or len(crops) == 1) and result['confidence'] < self.min_confidence]
+        if not retry:
+            return _combine(results, FAST)
+
+        logger.info(f'OCR: escalating {len(retry)}/{len(crops)} crops to the accurate tier')
+        for i, result in zip(retry, self._accurate([crops[i] for i in retry], psm)):
+            results[i] = result
+        return _combine(results, ACCURATE)
+
+
+def _combine(results, tier):
+    words = sum(result['words'] for result in results)
+    confidence = sum(result['confidence'] * result['words'] for result in results) / words if words else 0.0
+    return {
+        'text': '\n'.join(result['text'].strip() for result in results if result['text'].strip()),
+        'tier': tier,
+        'confidence': round(confidence, 2),
+    }
+
+
+def tiered_from_env(engine):
+    """Build a TieredOCR configured through OCR_TIERS* variables.
+
+    OCR_FAST_TESSDATA points at the tessdata_fast models; left empty the
+    fast pass uses the default models with the single fast language.
+    """
+    return TieredOCR(
+        engine,
+        enabled=os.getenv('OCR_TIERS', '1') == '1',
+        fast_lang=os.getenv('OCR_FAST_LANG', 'spa'),
+        fast_tessdata=os.getenv('OCR_FAST_TESSDATA') or None,
+        accurate_lang=os.getenv('OCR_ACCURATE_LANG', 'spa+eng'),
+        min_confidence=float(os.getenv('OCR_MIN_CONFIDENCE', '75')),
+    )
@@ -0,0 +1,181 @@
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def downscale(gray, max_side=1600, target_dpi=300, source_dpi=None):
+    """Shrink an image so OCR does not pay for pixels it does not need.
+
+    Images carrying DPI metadata above ``target_dpi`` are scaled to it;
+    any image is then capped at ``max_side`` pixels on its longer side.
+    Never upscales.
+    """
+    scale = 1.0
+    if source_dpi and source_dpi > target_dpi:
+        scale = target_dpi / source_dpi
+    height, width = gray.shape[:2]
+    scale = min(scale, max_side / max(height, width))
+    if scale >= 1.0:
+        return gray, 1.0
+    resized = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    return resized, scale
+
+
+def binarize(gray):
+    """Adaptive threshold to black text on white, robust to uneven photo lighting"""
+    binary = cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+    # Light text on a dark banner comes out inverted; flip so text is dark
+    if np.mean(binary) < 127:
+        binary = cv2.bitwise_not(binary)
+    return binary
+
+
+def binarize_region(gray):
+    """Otsu threshold within one text region, flipped so text is dark.
+
+    Thresholding per region adapts to each banner's own contrast and,
+    unlike a small adaptive window, keeps thick headline strokes solid.
+    The region's border is background, which tells the text polarity.
+    """
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    border = np.concatenate([binary[0, :], binary[-1, :], binary[:, 0], binary[:, -1]])
+    if np.mean(border) < 127:
+        binary = cv2.bitwise_not(binary)
+    return binary
+
+
+def find_text_regions(gray, min_height=8, padding=6):
+    """Bounding boxes ``(x, y, w, h)`` of text lines, found morphologically.
+
+    A morphological gradient highlights stroke edges, Otsu separates them
+    from background, and a closing kernel fuses the characters of a word
+    into one blob. Blobs are then joined into lines (see ``_join_lines``),
+    specks too small to be text are dropped, and overlapping boxes merged.
+    """
+    height, width = gray.shape[:2]
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(9, width // 60), max(3, height // 300)))
+    connected = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(connected, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if h < min_height:
+            continue
+        # Text lines are mostly edges; photo texture is not that dense
+        fill = cv2.countNonZero(edges[y:y + h, x:x + w]) / float(w * h)
+        if fill < 0.1:
+            continue
+        boxes.append((x, y, x + w, y + h))
+
+    padded = []
+    for x1, y1, x2, y2 in _join_lines(boxes):
+        w, h = x2 - x1, y2 - y1
+        # Narrow blobs are not text; small ones that are not line-shaped are
+        # icons and JPEG debris
+        if w < h or (w < 8 * h and w * h < (4 * min_height) ** 2):
+            continue
+        padded.append((max(0, x1 - padding), max(0, y1 - padding),
+                       min(width, x2 + padding), min(height, y2 + padding)))
+    return [(x1, y1, x2 - x1, y2 - y1) for x1, y1, x2, y2 in _merge(padded)]
+
+
+def _same_line(a, b):
+    """Whether two ``(x1, y1, x2, y2)`` boxes share at least half of the shorter one's height"""
+    overlap = min(a[3], b[3]) - max(a[1], b[1])
+    return overlap >= 0.5 * min(a[3] - a[1], b[3] - b[1])
+
+
+def _join_lines(boxes):
+    """Join word boxes into line boxes.
+
+    Two boxes of similar height are on one line when their vertical
+    ranges overlap by half the shorter height; they are joined when the
+    horizontal gap between them is at most the taller height, which spans
+    a word space at any font size but not the margin between columns.
+    """
+    joined = True
+    while joined:
+        joined = False
+        result = []
+        for box in sorted(boxes):
+            for i, other in enumerate(result):
+                gap = max(box[0], other[0]) - min(box[2], other[2])
+                short, tall = sorted((box[3] - box[1], other[3] - other[1]))
+                if _same_line(box, other) and 2 * short >= tall and gap <= tall:
+                    result[i] = (min(box[0], other[0]), min(box[1], other[1]),
+                                 max(box[2], other[2]), max(box[3], other[3]))
+                    joined = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return boxes
+
+
+def _merge(boxes):
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for box in sorted(boxes):
+            for i, other in enumerate(result):
+                if box[0] <= other[2] and other[0] <= box[2] and box[1] <= other[3] and other[1] <= box[3]:
+                    result[i] = (min(box[0], other[0]), min(box[1], other[1]),
+                                 max(box[2], other[2]), max(box[3], other[3]))
+                    merged = True
+                    break
+            else:
+                result.append(box)
+        boxes = result
+    return boxes
+
+
+def reading_order(boxes):
+    """Sort ``(x, y, w, h)`` boxes top to bottom, then left to right within a line.
+
+    Boxes on one line start a few pixels apart, so sorting on the exact
+    ``y`` would interleave lines; boxes are grouped by vertical overlap
+    with the line's first box instead.
+    """
+    lines = []
+    for box in sorted(boxes, key=lambda box: box[1]):
+        x, y, w, h = box
+        if lines and _same_line(lines[-1][0], (x, y, x + w, y + h)):
+            lines[-1][1].append(box)
+        else:
+            lines.append(((x, y, x + w, y + h), [box]))
+    return [box for _, line in lines for box in sorted(line)]
+
+
+def text_crops(img, max_side=1600, target_dpi=300, max_coverage=0.6):
+    """Preprocess a PIL image and return binarized crops of its text regions.
+
+    Each crop is one line of text, in reading order (lines top to bottom,
+    left to right within a line).
+    When no region is found, or the regions cover most of the image, the
+    whole binarized image is returned as a single crop.
+    """
+    dpi = img.info.get('dpi')
+    gray = np.array(img.convert('L'))
+    gray, _ = downscale(gray, max_side=max_side, target_dpi=target_dpi, source_dpi=dpi[0] if dpi else None)
+    boxes = find_text_regions(gray)
+    area = float(gray.shape[0] * gray.shape[1])
+    if not boxes or sum(w * h for _, _, w, h in boxes) / area > max_coverage:
+        return [Image.fromarray(binarize(gray))]
+
+    return [Image.fromarray(binarize_region(gray[y:y + h, x:x + w])) for x, y, w, h in reading_order(boxes)]
+
+
+def settings_from_env():
+    """Preprocessing settings from OCR_PREPROCESS* variables"""
+    return {
+        'enabled': os.getenv('OCR_PREPROCESS', '1') == '1',
+        'max_side': int(os.getenv('OCR_PREPROCESS_MAX_SIDE', '1600')),
+        'target_dpi': int(os.getenv('OCR_PREPROCESS_TARGET_DPI', '300')),
+    }
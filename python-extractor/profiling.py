@@ -0,0 +1,202 @@
+import cProfile
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+# Files written per profile, by format name
+FORMATS = {'pstats': 'pstats', 'collapsed': 'collapsed.txt', 'speedscope': 'speedscope.json'}
+_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class StackSampler:
+    """Sampling profiler for one thread.
+
+    A background thread reads the target thread's stack every ``interval``
+    seconds through ``sys._current_frames`` and counts identical stacks,
+    weighted by the time elapsed since the previous sample. The profiled
+    code runs at full speed, so slow Selenium waits and Tesseract calls
+    show up with their real share of wall time.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        # stack tuple (root first) -> seconds
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += now - last
+            last = now
+
+    def collapsed(self):
+        """Brendan Gregg's collapsed-stack format (flamegraph.pl, speedscope), weights in microseconds"""
+        return ''.join(f"{';'.join(stack)} {max(1, int(seconds * 1e6))}\n"
+                       for stack, seconds in self.stacks.most_common())
+
+    def speedscope(self, name):
+        frames, index, samples, weights = [], {}, [], []
+        for stack, seconds in self.stacks.most_common():
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({'name': frame})
+                ids.append(index[frame])
+            samples.append(ids)
+            weights.append(seconds)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+            'name': name,
+            'activeProfileIndex': 0,
+            'exporter': 'python-extractor',
+        }
+
+
+class RequestProfile:
+    """One profiled request: ``cprofile`` (deterministic) or ``sample`` mode"""
+
+    def __init__(self, mode, interval=0.005):
+        self.mode = mode
+        self.id = uuid.uuid4().hex
+        self.started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._start = time.perf_counter()
+        self.elapsed = None
+        if mode == 'cprofile':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._profiler = StackSampler(threading.get_ident(), interval)
+            self._profiler.start()
+
+    def stop(self):
+        if self.mode == 'cprofile':
+            self._profiler.disable()
+        else:
+            self._profiler.stop()
+        self.elapsed = time.perf_counter() - self._start
+
+
+class ProfileStore:
+    """Profiles kept on disk under their ID, newest ``max_profiles`` only"""
+
+    def __init__(self, profile_dir, max_profiles=50):
+        self.profile_dir = profile_dir
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def _path(self, profile_id, suffix):
+        return os.path.join(self.profile_dir, f'{profile_id}.{suffix}')
+
+    def save(self, profile, **meta):
+        """Write the profile's files and metadata; returns the metadata"""
+        if profile.mode == 'cprofile':
+            profile._profiler.dump_stats(self._path(profile.id, FORMATS['pstats']))
+            formats = ['pstats']
+        else:
+            sampler = profile._profiler
+            with open(self._path(profile.id, FORMATS['collapsed']), 'w', encoding='utf-8') as f:
+                f.write(sampler.collapsed())
+            with open(self._path(profile.id, FORMATS['speedscope']), 'w', encoding='utf-8') as f:
+                json.dump(sampler.speedscope(meta.get('path', profile.id)), f)
+            formats = ['collapsed', 'speedscope']
+
+        meta = dict(meta, id=profile.id, mode=profile.mode, started_at=profile.started_at,
+                    elapsed_ms=round(profile.elapsed * 1000, 1), formats=formats)
+        with open(self._path(profile.id, 'json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        self._prune()
+        return meta
+
+    def list(self):
+        """Metadata of the stored profiles, newest first"""
+        profiles = []
+        for name in os.listdir(self.profile_dir):
+            if not name.endswith('.json') or name.endswith('.speedscope.json'):
+                continue
+            try:
+                with open(os.path.join(self.profile_dir, name), 'r', encoding='utf-8') as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        profiles.sort(key=lambda meta: meta['started_at'], reverse=True)
+        return profiles
+
+    def path_for(self, profile_id, fmt):
+        """File of a stored profile in ``fmt``, or None"""
+        if not _ID_RE.match(profile_id) or fmt not in FORMATS:
+            return None
+        path = self._path(profile_id, FORMATS[fmt])
+        return path if os.path.exists(path) else None
+
+    def _prune(self):
+        with self._lock:
+            metas = sorted(
+                (name for name in os.listdir(self.profile_dir)
+                 if name.endswith('.json') and not name.endswith('.speedscope.json')),
+                key=lambda name: os.path.getmtime(os.path.join(self.profile_dir, name)))
+            for name in metas[:max(0, len(metas) - self.max_profiles)]:
+                profile_id = name[:-5]
+                for suffix in list(FORMATS.values()) + ['json']:
+                    try:
+                        os.remove(self._path(profile_id, suffix))
+                    except OSError:
+                        pass
+
+
+def profiling_from_env(default_dir):
+    """Profiling settings from PROFILING_* variables; ``store`` is None when disabled.
+
+    PROFILING_TOKEN, when set, must be sent in the X-Admin-Token header
+    both to profile a request and to read profiles.
+    """
+    enabled = os.getenv('PROFILING_ENABLED', '0') == '1'
+    return {
+        'enabled': enabled,
+        'token': os.getenv('PROFILING_TOKEN', ''),
+        'interval': float(os.getenv('PROFILING_INTERVAL', '0.005')),
+        'store': ProfileStore(
+            os.getenv('PROFILING_DIR') or os.path.join(default_dir, 'profiles'),
+            max_profiles=int(os.getenv('PROFILING_MAX_PROFILES', '50')),
+        ) if enabled else None,
+    }
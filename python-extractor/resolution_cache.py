@@ -0,0 +1,178 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+_HOST_ALIASES = {
+    'instagr.am': 'instagram.com',
+    'm.instagram.com': 'instagram.com',
+    'www.instagram.com': 'instagram.com',
+}
+_POST_KINDS = ('p', 'reel', 'reels', 'tv')
+
+
+def normalize_post_url(url):
+    """Canonical form of a post URL used as the cache key.
+
+    Instagram post and reel links such as ``/<user>/p/<code>/?img_index=1``
+    on any Instagram host are reduced to ``https://instagram.com/p/<code>/``.
+    Any other URL keeps its host, port, path and query string; only the
+    fragment, which never reaches the server, is dropped.
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    host = _HOST_ALIASES.get(host, host)
+    if host == 'instagram.com':
+        segments = [s for s in parts.path.split('/') if s]
+        for i, segment in enumerate(segments[:-1]):
+            if segment in _POST_KINDS:
+                return f"https://instagram.com/{'reel' if segment == 'reels' else segment}/{segments[i + 1]}/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ''))
+
+
+class ResolutionCache:
+    """Post URL -> resolved image URL cache with TTL and LRU eviction.
+
+    Entries live in an in-memory LRU. When ``db_path`` is given they are
+    also written through to SQLite so they survive restarts. Hits only
+    refresh the on-disk access time, which drives eviction on disk, so
+    those updates are batched: written every ``flush_every`` hits or
+    ``flush_seconds``, and before each put. SQLite is never touched while
+    the memory lock is held.
+    """
+
+    def __init__(self, ttl=6 * 3600, max_entries=10000, db_path=None, flush_every=100, flush_seconds=30):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        # key -> accessed_at not yet written to SQLite
+        self._touched = {}
+        self._unflushed_hits = 0
+        self._flushed_at = time.time()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS resolutions ('
+                'key TEXT PRIMARY KEY, img_url TEXT NOT NULL, '
+                'created_at REAL NOT NULL, accessed_at REAL NOT NULL)')
+            self._db.commit()
+
+    def get(self, url):
+        key = normalize_post_url(url)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None and self._db is not None:
+            with self._db_lock:
+                row = self._db.execute(
+                    'SELECT img_url, created_at FROM resolutions WHERE key = ?', (key,)).fetchone()
+            if row:
+                entry = tuple(row)
+                with self._lock:
+                    self._remember(key, entry)
+
+        if entry is None or now - entry[1] > self.ttl:
+            if entry is not None:
+                self._delete(key)
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+
+        batch = None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            if self._db is not None:
+                self._touched[key] = now
+                self._unflushed_hits += 1
+                if self._unflushed_hits >= self.flush_every or now - self._flushed_at >= self.flush_seconds:
+                    batch = self._take_touched(now)
+        if batch:
+            with self._db_lock:
+                self._write_touched(batch)
+                self._db.commit()
+        return entry[0]
+
+    def put(self, url, img_url):
+        key = normalize_post_url(url)
+        now = time.time()
+        with self._lock:
+            self._remember(key, (img_url, now))
+            batch = self._take_touched(now) if self._db is not None else None
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._write_touched(batch)
+            self._db.execute(
+                'INSERT OR REPLACE INTO resolutions (key, img_url, created_at, accessed_at) '
+                'VALUES (?, ?, ?, ?)', (key, img_url, now, now))
+            # LRU eviction on disk as well
+            self._db.execute(
+                'DELETE FROM resolutions WHERE key NOT IN ('
+                'SELECT key FROM resolutions ORDER BY accessed_at DESC LIMIT ?)',
+                (self.max_entries,))
+            self._db.commit()
+
+    def invalidate(self, url):
+        key = normalize_post_url(url)
+        self._delete(key)
+        with self._lock:
+            self.stats['invalidations'] += 1
+        logger.info(f'Resolution cache: invalidated {key}')
+
+    def _remember(self, key, entry):
+        # Called with the lock held
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _take_touched(self, now):
+        # Called with the lock held
+        batch = list(self._touched.items())
+        self._touched.clear()
+        self._unflushed_hits = 0
+        self._flushed_at = now
+        return batch
+
+    def _write_touched(self, batch):
+        # Called with the database lock held; the caller commits
+        self._db.executemany('UPDATE resolutions SET accessed_at = ? WHERE key = ?',
+                             [(accessed_at, key) for key, accessed_at in batch])
+
+    def _delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._touched.pop(key, None)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute('DELETE FROM resolutions WHERE key = ?', (key,))
+                self._db.commit()
+
+
+def cache_from_env(default_dir):
+    """Build a ResolutionCache configured through RESOLUTION_CACHE_* variables.
+
+    RESOLUTION_CACHE_BACKEND is ``memory`` (default) or ``sqlite``; the
+    SQLite file defaults to ``resolutions.sqlite3`` inside ``default_dir``.
+    """
+    db_path = None
+    if os.getenv('RESOLUTION_CACHE_BACKEND', 'memory') == 'sqlite':
+        db_path = os.getenv('RESOLUTION_CACHE_PATH', os.path.join(default_dir, 'resolutions.sqlite3'))
+    return ResolutionCache(
+        ttl=float(os.getenv('RESOLUTION_CACHE_TTL', str(6 * 3600))),
+        max_entries=int(os.getenv('RESOLUTION_CACHE_MAX_ENTRIES', '10000')),
+        db_path=db_path,
+    )
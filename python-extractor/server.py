@@ -0,0 +1,22 @@
+"""Development server entry point: ``python server.py`` (``python app.py`` delegates here).
+
+OCR workers are spawned processes, and a spawned process re-imports the
+``__main__`` script. Keeping ``app`` out of this module's top level means
+the workers import only what they need (``ocr_engine``) instead of
+re-running the app's wiring: browser pool, stores, job threads.
+"""
+import os
+
+
+def main():
+    from app import app, browser_pool
+
+    # The reloader's watcher process imports the app too but never serves a
+    # request; only the child it restarts (WERKZEUG_RUN_MAIN) warms the browsers
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        browser_pool.warm_up()
+    app.run(debug=True, port=5000)
+
+
+if __name__ == '__main__':
+    main()
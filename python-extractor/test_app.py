@@ -0,0 +1,57 @@
+"""Response header tests for the Flask routes.
+
+The stores are pointed at a temporary directory before ``app`` is
+imported. Run from this directory with ``python -m unittest test_app``
+(or pytest).
+"""
+import importlib
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+app = None
+_env = None
+_tmp = None
+
+
+def setUpModule():
+    global app, _env, _tmp
+    _tmp = tempfile.mkdtemp()
+    _env = mock.patch.dict(os.environ, {
+        'TEXT_STORE_PATH': os.path.join(_tmp, 'texts.sqlite3'),
+        'ANALYSIS_CACHE_PATH': os.path.join(_tmp, 'analysis.sqlite3'),
+        'RESOLUTION_CACHE_PATH': os.path.join(_tmp, 'resolutions.sqlite3'),
+        'IMAGE_STORE_DIR': os.path.join(_tmp, 'images'),
+        'OCR_CACHE_DIR': os.path.join(_tmp, 'ocr_cache'),
+        'PROFILING_DIR': os.path.join(_tmp, 'profiles'),
+    })
+    _env.start()
+    app = importlib.import_module('app')
+
+
+def tearDownModule():
+    _env.stop()
+    shutil.rmtree(_tmp, ignore_errors=True)
+
+
+class HeaderTests(unittest.TestCase):
+    def setUp(self):
+        self.client = app.app.test_client()
+
+    def test_metrics_content_type_has_a_single_charset(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+
+    def test_text_exports_have_a_single_charset(self):
+        for fmt, content_type in [('txt', 'text/plain; charset=utf-8'), ('csv', 'text/csv; charset=utf-8'),
+                                  ('ndjson', 'application/x-ndjson')]:
+            response = self.client.get(f'/download-texts?format={fmt}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.headers['Content-Type'], content_type)
+
+
+if __name__ == '__main__':
+    unittest.main()
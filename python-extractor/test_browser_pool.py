@@ -0,0 +1,67 @@
+"""Tests for the browser pool's shutdown, with Chrome replaced by a stub driver.
+
+Run from this directory with ``python -m unittest test_browser_pool`` (or pytest).
+"""
+import threading
+import unittest
+from unittest import mock
+
+import browser_pool
+from browser_pool import BrowserPool
+
+
+class StubDriver:
+    def __init__(self):
+        self.quit_called = False
+
+    def execute_script(self, script):
+        return 1
+
+    def delete_all_cookies(self):
+        pass
+
+    def quit(self):
+        self.quit_called = True
+
+
+class CloseTests(unittest.TestCase):
+    def test_driver_launched_during_close_is_quit(self):
+        started, release = threading.Event(), threading.Event()
+        drivers = []
+
+        def chrome(options=None):
+            started.set()
+            release.wait(5)
+            drivers.append(StubDriver())
+            return drivers[-1]
+
+        pool = BrowserPool(size=2)
+        with mock.patch.object(browser_pool.webdriver, 'Chrome', side_effect=chrome):
+            pool.warm_up()
+            self.assertTrue(started.wait(5))
+            pool.close()
+            release.set()
+            warmup = [t for t in threading.enumerate() if t.name == 'browser-pool-warmup']
+            for thread in warmup:
+                thread.join(5)
+
+        self.assertEqual(len(drivers), 1)
+        self.assertTrue(drivers[0].quit_called)
+        self.assertTrue(pool._idle.empty())
+        # The slot was given back
+        self.assertTrue(pool._slots.acquire(blocking=False))
+
+    def test_checked_out_driver_is_quit_on_return_after_close(self):
+        pool = BrowserPool(size=1, prelaunch=False)
+        with mock.patch.object(browser_pool.webdriver, 'Chrome', side_effect=lambda options=None: StubDriver()):
+            with pool.driver() as driver:
+                pool.close()
+        self.assertTrue(driver.quit_called)
+        self.assertTrue(pool._idle.empty())
+        with self.assertRaises(RuntimeError):
+            with pool.driver():
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Tests for the background job manager.
+
+Run from this directory with ``python -m unittest test_jobs`` (or pytest).
+"""
+import threading
+import unittest
+
+from jobs import JobManager
+
+
+def _events(manager, job):
+    return [chunk.split('\n')[0] for chunk in manager.stream(job, keepalive=5) if chunk.startswith('event:')]
+
+
+class JobManagerTests(unittest.TestCase):
+    def setUp(self):
+        self.manager = JobManager(max_workers=1, max_pending=2)
+
+    def tearDown(self):
+        self.manager.shutdown()
+
+    def test_finished_job_streams_its_status_before_the_result(self):
+        job = self.manager.submit('test', lambda progress: progress('working') or 'ok')
+        events = _events(self.manager, job)
+        self.assertEqual(events, ['event: queued', 'event: started', 'event: progress',
+                                  'event: succeeded', 'event: result'])
+        self.assertEqual(job.result, 'ok')
+        self.assertIsNotNone(job.finished_at)
+
+    def test_job_cancelled_after_its_worker_picked_it_up_finishes(self):
+        picked_up = threading.Event()
+        release = threading.Event()
+
+        def run(progress):
+            return 'ran'
+
+        # Hold the worker inside _run's submission, as if cancel() raced the pool
+        original = self.manager._run
+
+        def delayed_run(job, fn, args):
+            picked_up.set()
+            release.wait(5)
+            return original(job, fn, args)
+
+        self.manager._run = delayed_run
+        job = self.manager.submit('test', run)
+        self.assertTrue(picked_up.wait(5))
+        self.manager.cancel(job.id)
+        release.set()
+
+        self.assertEqual(_events(self.manager, job)[-2:], ['event: cancelled', 'event: result'])
+        self.assertEqual(job.status, 'cancelled')
+        self.assertIsNone(job.result)
+        self.assertIsNotNone(job.finished_at)
+        # No longer counted against max_pending
+        self.manager.submit('test', run)
+        self.manager.submit('test', run)
+
+
+if __name__ == '__main__':
+    unittest.main()
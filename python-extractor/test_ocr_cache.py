@@ -0,0 +1,104 @@
+"""Tests for the content-addressed OCR result cache.
+
+Run from this directory with ``python -m unittest test_ocr_cache`` (or pytest).
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from ocr_cache import OCRCache
+
+SAMPLE_CARD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'temp_instagram_image.jpg')
+PARAMS = {'lang': 'spa'}
+
+
+def encode(img, quality=85, scale=1.0):
+    if scale != 1.0:
+        img = img.resize((int(img.width * scale), int(img.height * scale)))
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=quality)
+    data = buffer.getvalue()
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    return data, img
+
+
+def with_last_line(img, text):
+    """The sample card with its last headline line painted over and rewritten"""
+    pixels = np.array(img.convert('RGB'))
+    pixels[1090:1170, 80:1000] = pixels[1010:1015, 80:1000].mean(axis=0).astype(np.uint8)
+    cv2.putText(pixels, text, (94, 1150), cv2.FONT_HERSHEY_SIMPLEX, 2.2, (255, 255, 255), 6)
+    return Image.fromarray(pixels)
+
+
+class OCRCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = OCRCache(self.dir)
+        self.card = Image.open(SAMPLE_CARD).convert('RGB')
+        self.data, self.img = encode(self.card)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_exact_bytes_hit(self):
+        self.cache.put(self.data, self.img, PARAMS, 'Gustavo Petro advierte')
+        self.assertEqual(self.cache.get(self.data, self.img, PARAMS), 'Gustavo Petro advierte')
+        self.assertEqual(self.cache.snapshot()['exact_hits'], 1)
+        self.assertIsNone(self.cache.get(self.data, self.img, {'lang': 'eng'}))
+
+    def test_reencoded_copy_hits(self):
+        self.cache.put(self.data, self.img, PARAMS, 'Gustavo Petro advierte')
+        for quality, scale in [(40, 1.0), (85, 0.5)]:
+            data, img = encode(self.card, quality, scale)
+            self.assertEqual(self.cache.get(data, img, PARAMS), 'Gustavo Petro advierte')
+        self.assertEqual(self.cache.snapshot()['perceptual_hits'], 2)
+
+    def test_same_layout_with_another_headline_misses(self):
+        first_data, first_img = encode(with_last_line(self.card, 'consulta popular 2025'))
+        self.cache.put(first_data, first_img, PARAMS, 'primer titular')
+        data, img = encode(with_last_line(self.card, 'no habra consulta'))
+        self.assertIsNone(self.cache.get(data, img, PARAMS))
+        self.assertEqual(self.cache.snapshot()['perceptual_rejects'], 1)
+
+    def test_malformed_entries_are_skipped_on_load(self):
+        self.cache.put(self.data, self.img, PARAMS, 'texto')
+        for name, content in [('a.json', json.dumps({'text': 'sin params'})), ('b.json', '[1, 2]'), ('c.json', '{')]:
+            with open(os.path.join(self.dir, name), 'w', encoding='utf-8') as f:
+                f.write(content)
+        with self.assertLogs('ocr_cache', 'WARNING'):
+            reloaded = OCRCache(self.dir)
+        self.assertEqual(reloaded.snapshot()['entries'], 1)
+        self.assertEqual(reloaded.get(self.data, self.img, PARAMS), 'texto')
+
+    def test_concurrent_puts_and_gets(self):
+        errors = []
+
+        def work():
+            try:
+                for _ in range(20):
+                    self.cache.put(self.data, self.img, PARAMS, 'texto')
+                    self.assertEqual(self.cache.get(self.data, self.img, PARAMS), 'texto')
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.cache.snapshot()['entries'], 1)
+        self.assertEqual([name for name in os.listdir(self.dir) if name.endswith('.tmp')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
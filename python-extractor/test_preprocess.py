@@ -0,0 +1,54 @@
+"""Tests for text region detection and reading order.
+
+Run from this directory with ``python -m unittest test_preprocess`` (or pytest).
+"""
+import os
+import unittest
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import preprocess
+
+SAMPLE_CARD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'temp_instagram_image.jpg')
+
+
+class ReadingOrderTests(unittest.TestCase):
+    def test_words_a_few_pixels_apart_stay_on_their_line(self):
+        # Word boxes of a two-line headline; each word sits at a slightly different y
+        boxes = [(595, 854, 293, 65), (94, 859, 286, 59), (393, 859, 193, 59),
+                 (244, 933, 294, 64), (94, 947, 140, 61), (547, 947, 140, 61)]
+        self.assertEqual([box[0] for box in preprocess.reading_order(boxes)], [94, 393, 595, 94, 244, 547])
+
+    def test_sample_card_is_read_line_by_line(self):
+        gray, _ = preprocess.downscale(np.array(Image.open(SAMPLE_CARD).convert('L')))
+        boxes = preprocess.reading_order(preprocess.find_text_regions(gray))
+        # "Gustavo Petro advierte / que ministro que no / firme decreto sobre / consulta popular "se va""
+        self.assertEqual(len(boxes), 4)
+        tops = [y for _, y, _, _ in boxes]
+        self.assertEqual(tops, sorted(tops))
+        for x, y, w, h in boxes:
+            self.assertLess(x, 120)
+            self.assertGreater(w, 600)
+        self.assertEqual(len(preprocess.text_crops(Image.open(SAMPLE_CARD))), 4)
+
+
+class RegionTests(unittest.TestCase):
+    def test_words_are_joined_and_specks_dropped(self):
+        gray = np.full((600, 800), 255, dtype=np.uint8)
+        lines = ['uno dos tres', 'cuatro cinco']
+        for i, line in enumerate(lines):
+            cv2.putText(gray, line, (40, 200 * (i + 1)), cv2.FONT_HERSHEY_SIMPLEX, 2, 0, 5)
+        cv2.rectangle(gray, (700, 40), (712, 50), 0, -1)
+        boxes = preprocess.reading_order(preprocess.find_text_regions(gray))
+        self.assertEqual(len(boxes), 2)
+        self.assertLess(boxes[0][1], boxes[1][1])
+        for (x, y, w, h), line in zip(boxes, lines):
+            (width, _), _ = cv2.getTextSize(line, cv2.FONT_HERSHEY_SIMPLEX, 2, 5)
+            self.assertLessEqual(x, 40)
+            self.assertGreaterEqual(w, width)
+
+
+if __name__ == '__main__':
+    unittest.main()
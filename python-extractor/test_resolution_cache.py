@@ -0,0 +1,65 @@
+"""Tests for the post URL -> image URL resolution cache.
+
+Run from this directory with ``python -m unittest test_resolution_cache`` (or pytest).
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from resolution_cache import ResolutionCache, normalize_post_url
+
+
+class NormalizeTests(unittest.TestCase):
+    def test_instagram_posts_share_a_key(self):
+        key = 'https://instagram.com/p/ABC123/'
+        for url in ['https://www.instagram.com/p/ABC123/?img_index=1',
+                    'http://instagram.com/someone/p/ABC123',
+                    'https://m.instagram.com/p/ABC123/#comments']:
+            self.assertEqual(normalize_post_url(url), key)
+        self.assertEqual(normalize_post_url('https://www.instagram.com/reels/XYZ/'), 'https://instagram.com/reel/XYZ/')
+
+    def test_other_urls_keep_query_and_port(self):
+        self.assertNotEqual(normalize_post_url('https://example.com/post?id=1'),
+                            normalize_post_url('https://example.com/post?id=2'))
+        self.assertNotEqual(normalize_post_url('http://127.0.0.1:8767/p.html'),
+                            normalize_post_url('http://127.0.0.1:8768/p.html'))
+        self.assertEqual(normalize_post_url('https://Example.com/a?b=1#top'), 'https://example.com/a?b=1')
+
+
+class SQLiteCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'resolutions.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def accessed_at(self, url):
+        with sqlite3.connect(self.path) as db:
+            return db.execute('SELECT accessed_at FROM resolutions WHERE key = ?',
+                              (normalize_post_url(url),)).fetchone()[0]
+
+    def test_access_times_are_written_in_batches(self):
+        cache = ResolutionCache(db_path=self.path, flush_every=3, flush_seconds=3600)
+        cache.put('https://instagram.com/p/A/', 'https://cdn/a.jpg')
+        written = self.accessed_at('https://instagram.com/p/A/')
+        cache.get('https://instagram.com/p/A/')
+        cache.get('https://instagram.com/p/A/')
+        self.assertEqual(self.accessed_at('https://instagram.com/p/A/'), written)
+        cache.get('https://instagram.com/p/A/')
+        self.assertGreater(self.accessed_at('https://instagram.com/p/A/'), written)
+
+    def test_rows_loaded_from_disk_respect_max_entries(self):
+        writer = ResolutionCache(db_path=self.path, max_entries=10)
+        for i in range(5):
+            writer.put(f'https://instagram.com/p/{i}/', f'https://cdn/{i}.jpg')
+        cache = ResolutionCache(db_path=self.path, max_entries=2)
+        for i in range(5):
+            self.assertEqual(cache.get(f'https://instagram.com/p/{i}/'), f'https://cdn/{i}.jpg')
+        self.assertEqual(len(cache._entries), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
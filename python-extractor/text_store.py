@@ -0,0 +1,307 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+
+from dedup import SimHashIndex, simhash, to_signed, to_unsigned
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+LEGACY_HEADER = 'Archivo de textos extraídos\n' + '=' * 30 + '\n\n'
+LEGACY_SEPARATOR = '=' * 50
+
+# One block of the legacy extracted_texts.txt format written by save_extracted_text
+_LEGACY_ENTRY_RE = re.compile(
+    r'^--- (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) ---\n(.*?)\n={50}$',
+    re.MULTILINE | re.DOTALL)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS extractions (
+    id INTEGER PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    source_url TEXT,
+    image_hash TEXT,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS extractions_created_at ON extractions (created_at);
+CREATE INDEX IF NOT EXISTS extractions_image_hash ON extractions (image_hash);
+CREATE VIRTUAL TABLE IF NOT EXISTS extractions_fts USING fts5(
+    text, content='extractions', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS extractions_ai AFTER INSERT ON extractions BEGIN
+    INSERT INTO extractions_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS extractions_ad AFTER DELETE ON extractions BEGIN
+    INSERT INTO extractions_fts (extractions_fts, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+CREATE TRIGGER IF NOT EXISTS extractions_au AFTER UPDATE OF text ON extractions BEGIN
+    INSERT INTO extractions_fts (extractions_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    INSERT INTO extractions_fts (rowid, text) VALUES (new.id, new.text);
+END;
+CREATE TABLE IF NOT EXISTS sightings (
+    id INTEGER PRIMARY KEY,
+    extraction_id INTEGER NOT NULL REFERENCES extractions (id),
+    seen_at TEXT NOT NULL,
+    source_url TEXT,
+    image_hash TEXT,
+    distance INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sightings_extraction ON sightings (extraction_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+def fts_query(query):
+    """Turn free user input into an FTS5 query matching every word"""
+    words = re.findall(r'\w+', query, re.UNICODE)
+    return ' '.join(f'"{word}"' for word in words)
+
+
+def format_legacy_entry(entry):
+    """Render one row in the old extracted_texts.txt block format"""
+    return f"\n\n--- {entry['created_at']} ---\n{entry['text'].strip()}\n{LEGACY_SEPARATOR}\n"
+
+
+# Columns added after the table was first created: (name, definition)
+MIGRATIONS = [
+    ('simhash', 'INTEGER'),
+    ('ocr_tier', 'TEXT'),
+    ('ocr_confidence', 'REAL'),
+]
+
+
+class TextStore:
+    """Extracted texts stored as rows in SQLite (WAL mode) with an FTS5 index.
+
+    Each thread gets its own connection; WAL lets readers run while a
+    save is being written. When ``dedup_distance`` is set, a text whose
+    SimHash is within that many bits of a stored one is not stored again:
+    the save is recorded as a sighting of the existing row instead.
+    """
+
+    def __init__(self, db_path, dedup_distance=3):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._dedup = SimHashIndex(dedup_distance) if dedup_distance is not None else None
+        with self._write_lock:
+            conn = self._conn()
+            conn.executescript(SCHEMA)
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(extractions)')}
+            for name, definition in MIGRATIONS:
+                if name not in columns:
+                    conn.execute(f'ALTER TABLE extractions ADD COLUMN {name} {definition}')
+            conn.commit()
+        if self._dedup is not None:
+            self._load_dedup_index()
+
+    def _load_dedup_index(self):
+        conn = self._conn()
+        missing = []
+        for row in conn.execute('SELECT id, text, simhash FROM extractions'):
+            value = to_unsigned(row['simhash']) if row['simhash'] is not None else simhash(row['text'])
+            if row['simhash'] is None:
+                missing.append((to_signed(value), row['id']))
+            self._dedup.add(row['id'], value)
+        if missing:
+            with self._write_lock:
+                conn.executemany('UPDATE extractions SET simhash = ? WHERE id = ?', missing)
+                conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, text, source_url=None, image_hash=None, created_at=None, ocr_tier=None, ocr_confidence=None):
+        """Store one extraction, with the OCR tier and confidence that produced it.
+
+        Returns ``(row_id, duplicate)``; for a near-duplicate ``row_id`` is
+        the existing entry the save was linked to.
+        """
+        created_at = created_at or datetime.now().strftime(TIMESTAMP_FORMAT)
+        text = text.strip()
+        value = simhash(text)
+        with self._write_lock:
+            conn = self._conn()
+            match = self._dedup.find(value) if self._dedup is not None else None
+            if match is not None:
+                row_id, distance = match
+                conn.execute(
+                    'INSERT INTO sightings (extraction_id, seen_at, source_url, image_hash, distance) '
+                    'VALUES (?, ?, ?, ?, ?)', (row_id, created_at, source_url, image_hash, distance))
+                conn.commit()
+                logger.info(f'Near-duplicate of entry {row_id} (distance {distance}), not stored again')
+                return row_id, True
+
+            cursor = conn.execute(
+                'INSERT INTO extractions (created_at, source_url, image_hash, text, simhash, ocr_tier, ocr_confidence) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (created_at, source_url, image_hash, text, to_signed(value), ocr_tier, ocr_confidence))
+            conn.commit()
+            if self._dedup is not None:
+                self._dedup.add(cursor.lastrowid, value)
+            return cursor.lastrowid, False
+
+    def count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM extractions').fetchone()[0]
+
+    def stats(self):
+        """Stored entries, suppressed near-duplicates, the dedup ratio and OCR tier counts"""
+        conn = self._conn()
+        stored = self.count()
+        duplicates = conn.execute('SELECT COUNT(*) FROM sightings').fetchone()[0]
+        saves = stored + duplicates
+        tiers = conn.execute(
+            'SELECT ocr_tier, COUNT(*), AVG(ocr_confidence) FROM extractions '
+            'WHERE ocr_tier IS NOT NULL GROUP BY ocr_tier').fetchall()
+        return {
+            'stored': stored,
+            'duplicates_suppressed': duplicates,
+            'dedup_ratio': round(duplicates / saves, 4) if saves else 0.0,
+            'ocr_tiers': {tier: {'count': n, 'mean_confidence': round(avg or 0.0, 2)} for tier, n, avg in tiers},
+        }
+
+    def search(self, query='', page=1, per_page=20):
+        """Full-text search, best matches first; without a query, newest first"""
+        offset = (page - 1) * per_page
+        conn = self._conn()
+        match = fts_query(query) if query else ''
+        if match:
+            total = conn.execute(
+                'SELECT COUNT(*) FROM extractions_fts WHERE extractions_fts MATCH ?', (match,)).fetchone()[0]
+            rows = conn.execute(
+                'SELECT e.id, e.created_at, e.source_url, e.image_hash, e.text, e.ocr_tier, e.ocr_confidence, '
+                "snippet(extractions_fts, 0, '[', ']', '…', 12) AS snippet "
+                'FROM extractions_fts JOIN extractions e ON e.id = extractions_fts.rowid '
+                'WHERE extractions_fts MATCH ? ORDER BY bm25(extractions_fts) LIMIT ? OFFSET ?',
+                (match, per_page, offset)).fetchall()
+        else:
+            total = self.count()
+            rows = conn.execute(
+                'SELECT id, created_at, source_url, image_hash, text, ocr_tier, ocr_confidence FROM extractions '
+                'ORDER BY id DESC LIMIT ? OFFSET ?', (per_page, offset)).fetchall()
+        return {
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'items': [dict(row) for row in rows],
+        }
+
+    def max_id(self):
+        """Id of the newest entry, 0 when the store is empty"""
+        return self._conn().execute('SELECT COALESCE(MAX(id), 0) FROM extractions').fetchone()[0]
+
+    def iter_entries(self, after_id=0, batch_size=500):
+        """Yield entries with id > ``after_id``, oldest first, without loading the whole table"""
+        last_id = after_id
+        while True:
+            # Looked up per batch: a streaming response may resume on another thread
+            rows = self._conn().execute(
+                'SELECT id, created_at, source_url, image_hash, text FROM extractions '
+                'WHERE id > ? ORDER BY id LIMIT ?', (last_id, batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+            last_id = rows[-1]['id']
+
+    def iter_export(self, after_id=0, up_to_id=None, since=None, until=None, source=None, query='',
+                    batch_size=500):
+        """Yield entries matching the export filters, oldest first, one batch in memory at a time.
+
+        ``after_id``/``up_to_id`` bound the id range (the export cursor),
+        ``since``/``until`` the created_at timestamps (inclusive),
+        ``source`` is a substring of the source URL and ``query`` a
+        full-text search.
+        """
+        conditions, params = [], []
+        if up_to_id is not None:
+            conditions.append('id <= ?')
+            params.append(up_to_id)
+        if since:
+            conditions.append('created_at >= ?')
+            params.append(since)
+        if until:
+            conditions.append('created_at <= ?')
+            params.append(until)
+        if source:
+            conditions.append('instr(source_url, ?) > 0')
+            params.append(source)
+        match = fts_query(query) if query else ''
+        if match:
+            conditions.append('id IN (SELECT rowid FROM extractions_fts WHERE extractions_fts MATCH ?)')
+            params.append(match)
+        where = ''.join(f' AND {condition}' for condition in conditions)
+
+        last_id = after_id
+        while True:
+            rows = self._conn().execute(
+                'SELECT id, created_at, source_url, image_hash, ocr_tier, ocr_confidence, text '
+                f'FROM extractions WHERE id > ?{where} ORDER BY id LIMIT ?',
+                [last_id] + params + [batch_size]).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+            last_id = rows[-1]['id']
+
+    def entries_by_id(self, ids, batch_size=500):
+        """Yield the entries with the given ids, oldest first"""
+        ids = sorted(set(ids))
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            rows = self._conn().execute(
+                'SELECT id, created_at, source_url, image_hash, text FROM extractions '
+                f'WHERE id IN ({",".join("?" * len(chunk))}) ORDER BY id', chunk).fetchall()
+            for row in rows:
+                yield dict(row)
+
+    def import_legacy_file(self, path):
+        """One-time import of an extracted_texts.txt file; returns rows added"""
+        key = f'legacy_import:{os.path.abspath(path)}'
+        conn = self._conn()
+        if conn.execute('SELECT 1 FROM meta WHERE key = ?', (key,)).fetchone():
+            return 0
+        if not os.path.exists(path):
+            return 0
+
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        added = 0
+        for created_at, text in _LEGACY_ENTRY_RE.findall(content):
+            if text.strip():
+                _, duplicate = self.add(text, created_at=created_at)
+                added += not duplicate
+        with self._write_lock:
+            conn.execute(
+                'INSERT INTO meta (key, value) VALUES (?, ?)',
+                (key, datetime.now().strftime(TIMESTAMP_FORMAT)))
+            conn.commit()
+        logger.info(f'Imported {added} entries from {path}')
+        return added
+
+
+def text_store_from_env(default_dir):
+    """Open the TextStore at TEXT_STORE_PATH (default: texts.sqlite3 in ``default_dir``).
+
+    TEXT_STORE_DEDUP_DISTANCE is the SimHash distance in bits under which
+    two texts count as the same entry; an empty value disables dedup.
+    """
+    distance = os.getenv('TEXT_STORE_DEDUP_DISTANCE', '3')
+    return TextStore(
+        os.getenv('TEXT_STORE_PATH') or os.path.join(default_dir, 'texts.sqlite3'),
+        dedup_distance=int(distance) if distance else None,
+    )
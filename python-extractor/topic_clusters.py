@@ -0,0 +1,267 @@
+import logging
+import math
+import os
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime
+
+import numpy as np
+
+from dedup import normalize_text
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Palabras vacías en español e inglés; no distinguen un tema de otro
+STOPWORDS = frozenset('''
+a al algo algunos ante antes asi aun aunque cada como con contra cual cuando de del desde donde dos durante e
+el ella ellas ellos en entre era es esa ese eso esta estan este esto estos fue fueron ha habia han hasta hay
+la las le les lo los mas me mi muy nada ni no nos o otra otro otros para pero por porque que quien se sea
+segun ser si sido sin sobre son su sus tambien tiene todo todos tras tu un una uno unos y ya
+about after all also an and are as at be been but by can for from had has have he her his if in into is it
+its more not of on or our over said she so than that the their them there they this to up was we were what
+when which who will with would you
+'''.split())
+
+
+def tokenize(text):
+    """Normalized content words: no accents, stopwords, numbers or 1-2 letter OCR debris"""
+    return [token for token in normalize_text(text).split()
+            if len(token) > 2 and not token.isdigit() and token not in STOPWORDS]
+
+
+class _Document:
+    __slots__ = ('id', 'created_at', 'terms', 'index', 'tf', 'label')
+
+    def __init__(self, entry_id, created_at, terms, index, tf):
+        self.id = entry_id
+        self.created_at = created_at
+        self.terms = terms
+        self.index = index
+        self.tf = tf
+        self.label = -1
+
+
+class TopicClusters:
+    """Incremental topic clustering of the stored texts, without a model call.
+
+    Each text becomes a sparse TF-IDF vector over ``features`` hashed
+    buckets (the hashing trick: no vocabulary to grow or persist). New
+    texts are assigned online to the most similar centroid when the cosine
+    similarity reaches ``threshold``, otherwise they start a new cluster
+    (up to ``max_clusters``); the centroid then moves towards the text
+    with a 1/n learning rate, as in mini-batch k-means.
+
+    IDF weights drift as the corpus grows, so after ``rebuild_every`` new
+    texts the clustering is refitted in a background thread: one online
+    pass with the current weights followed by ``passes`` k-means
+    reassignment passes. Cluster ids are only stable within a
+    ``version``; every rebuild increments it.
+    """
+
+    def __init__(self, features=1 << 14, threshold=0.25, max_clusters=30, passes=2, rebuild_every=200):
+        self.features = features
+        self.threshold = threshold
+        self.max_clusters = max_clusters
+        self.passes = passes
+        self.rebuild_every = rebuild_every
+        self.version = 0
+        self._lock = threading.Lock()
+        self._docs = []
+        self._df = np.zeros(features, dtype=np.float32)
+        self._centroids = np.zeros((0, features), dtype=np.float32)
+        self._sizes = []
+        self._term_counts = []
+        self._since_rebuild = 0
+        self._rebuilding = False
+
+    def _vectorize(self, entry_id, text, created_at):
+        terms = tokenize(text)
+        if not terms:
+            return None
+        buckets = Counter(zlib.crc32(term.encode('utf-8')) & (self.features - 1) for term in terms)
+        index = np.fromiter(buckets.keys(), dtype=np.int64, count=len(buckets))
+        # Sublinear term frequency: a headline repeated by OCR does not dominate
+        tf = 1.0 + np.log(np.fromiter(buckets.values(), dtype=np.float32, count=len(buckets)))
+        return _Document(entry_id, created_at, tuple(set(terms)), index, tf)
+
+    def _idf(self):
+        n = len(self._docs)
+        return np.log((1.0 + n) / (1.0 + self._df)) + 1.0
+
+    @staticmethod
+    def _weights(doc, idf):
+        values = doc.tf * idf[doc.index]
+        norm = float(np.sqrt(values @ values))
+        return values / norm if norm else values
+
+    def add(self, entry_id, text, created_at=None):
+        """Cluster one new stored text; returns its cluster id, or None if it has no content words"""
+        created_at = created_at or datetime.now().strftime(TIMESTAMP_FORMAT)
+        doc = self._vectorize(entry_id, text, created_at)
+        if doc is None:
+            return None
+        with self._lock:
+            self._docs.append(doc)
+            self._df[doc.index] += 1
+            label = doc.label = self._assign(doc, self._idf())
+            self._since_rebuild += 1
+            stale = self._since_rebuild >= self.rebuild_every and not self._rebuilding
+            if stale:
+                self._rebuilding = True
+        if stale:
+            threading.Thread(target=self._background_rebuild, name='topic-rebuild', daemon=True).start()
+        return label
+
+    def load(self, entries):
+        """Fit the clustering from scratch on ``entries`` (dicts with id, text and created_at)"""
+        docs = [doc for doc in (self._vectorize(e['id'], e['text'], e['created_at']) for e in entries)
+                if doc is not None]
+        with self._lock:
+            self._docs = docs
+            self._df = np.zeros(self.features, dtype=np.float32)
+            for doc in docs:
+                self._df[doc.index] += 1
+        self.rebuild()
+
+    def _assign(self, doc, idf):
+        # Online step, called with the lock held; returns the doc's cluster
+        values = self._weights(doc, idf)
+        label = -1
+        if len(self._sizes):
+            norms = np.linalg.norm(self._centroids, axis=1)
+            similarities = (self._centroids[:, doc.index] @ values) / np.maximum(norms, 1e-12)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold or len(self._sizes) >= self.max_clusters:
+                label = best
+        if label < 0:
+            label = len(self._sizes)
+            self._centroids = np.vstack([self._centroids, np.zeros((1, self.features), dtype=np.float32)])
+            self._sizes.append(0)
+            self._term_counts.append(Counter())
+        self._sizes[label] += 1
+        rate = 1.0 / self._sizes[label]
+        centroid = self._centroids[label]
+        centroid *= 1.0 - rate
+        centroid[doc.index] += rate * values
+        self._term_counts[label].update(doc.terms)
+        return label
+
+    def rebuild(self):
+        """Refit every cluster with the current IDF weights"""
+        start = time.perf_counter()
+        with self._lock:
+            docs = list(self._docs)
+            df = self._df.copy()
+        idf = np.log((1.0 + len(docs)) / (1.0 + df)) + 1.0
+        fitted = TopicClusters(self.features, self.threshold, self.max_clusters)
+        labels = self._refine(fitted, docs, [fitted._assign(doc, idf) for doc in docs], idf)
+
+        with self._lock:
+            self._centroids = fitted._centroids
+            self._sizes = fitted._sizes
+            self._term_counts = fitted._term_counts
+            for doc, label in zip(docs, labels):
+                doc.label = label
+            # Texts saved while the refit ran join the new clusters online
+            current_idf = self._idf()
+            for doc in self._docs[len(docs):]:
+                doc.label = self._assign(doc, current_idf)
+            self._since_rebuild = len(self._docs) - len(docs)
+            self.version += 1
+        logger.info(f'Topic clusters rebuilt: {len(docs)} texts in {len(fitted._sizes)} clusters '
+                    f'({round((time.perf_counter() - start) * 1000, 1)} ms)')
+
+    def _refine(self, fitted, docs, labels, idf):
+        """Spherical k-means passes over the online solution; returns each doc's label"""
+        labels = np.array(labels, dtype=np.int64)
+        if not docs or not fitted._sizes:
+            return labels.tolist()
+        weights = [self._weights(doc, idf) for doc in docs]
+        rows = np.concatenate([np.full(len(doc.index), i) for i, doc in enumerate(docs)])
+        cols = np.concatenate([doc.index for doc in docs])
+        values = np.concatenate(weights).astype(np.float32)
+        for _ in range(self.passes):
+            centroids = fitted._centroids
+            centroids = centroids / np.maximum(np.linalg.norm(centroids, axis=1), 1e-12)[:, None]
+            # Sparse docs x dense centroids: gather each centroid at the docs' buckets
+            similarities = np.column_stack([
+                np.bincount(rows, weights=centroids[k, cols] * values, minlength=len(docs))
+                for k in range(len(centroids))])
+            new_labels = similarities.argmax(axis=1)
+            if np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, (labels[rows], cols), values)
+            counts = np.bincount(labels, minlength=len(centroids))
+            keep = np.flatnonzero(counts)
+            # Clusters that lost every text are dropped and the rest renumbered
+            renumber = np.full(len(centroids), -1)
+            renumber[keep] = np.arange(len(keep))
+            labels = renumber[labels]
+            fitted._centroids = sums[keep] / counts[keep, None].astype(np.float32)
+        fitted._sizes = np.bincount(labels, minlength=len(fitted._centroids)).tolist()
+        fitted._term_counts = [Counter() for _ in fitted._sizes]
+        for doc, label in zip(docs, labels):
+            fitted._term_counts[label].update(doc.terms)
+        return labels.tolist()
+
+    def _background_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            logger.error(f'Error rebuilding topic clusters: {str(e)}', exc_info=True)
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def clusters(self, top_terms=8, min_size=1):
+        """Clusters, largest first, with their top terms by in-cluster frequency x IDF"""
+        with self._lock:
+            n = len(self._docs)
+            dates = {}
+            for doc in self._docs:
+                first, last = dates.get(doc.label, (doc.created_at, doc.created_at))
+                dates[doc.label] = (min(first, doc.created_at), max(last, doc.created_at))
+            result = []
+            for label, size in enumerate(self._sizes):
+                if size < min_size:
+                    continue
+                scored = (
+                    (count * math.log((1.0 + n) / (1.0 + self._df[zlib.crc32(term.encode('utf-8'))
+                                                                   & (self.features - 1)])), term)
+                    for term, count in self._term_counts[label].items())
+                terms = [term for _, term in sorted(scored, reverse=True)[:top_terms]]
+                first, last = dates.get(label, (None, None))
+                result.append({
+                    'id': label,
+                    'size': size,
+                    'terms': terms,
+                    'label': ' '.join(terms[:3]),
+                    'first_at': first,
+                    'last_at': last,
+                })
+        result.sort(key=lambda cluster: cluster['size'], reverse=True)
+        return {'version': self.version, 'documents': n, 'clusters': result}
+
+    def entry_ids(self, labels):
+        """Stored entry ids in the given clusters, oldest first"""
+        wanted = set(labels)
+        with self._lock:
+            return [doc.id for doc in self._docs if doc.label in wanted]
+
+
+def clusters_from_env():
+    """TopicClusters configured through TOPIC_* variables; None when TOPIC_CLUSTERS=0"""
+    if os.getenv('TOPIC_CLUSTERS', '1') != '1':
+        return None
+    return TopicClusters(
+        features=1 << int(os.getenv('TOPIC_FEATURE_BITS', '14')),
+        threshold=float(os.getenv('TOPIC_SIMILARITY', '0.25')),
+        max_clusters=int(os.getenv('TOPIC_MAX_CLUSTERS', '30')),
+        passes=int(os.getenv('TOPIC_REFINE_PASSES', '2')),
+        rebuild_every=int(os.getenv('TOPIC_REBUILD_EVERY', '200')),
+    )